@@ -1,10 +1,19 @@
 #!/usr/bin/env python3
 """Analyze oncology trials CSV: trends by year, geography, site type, and sponsor tier."""
 
+import argparse
 import csv
+import hashlib
+import inspect
+import json
+import os
 import re
+import sys
 from collections import Counter, defaultdict
 
+from partitions import is_partitioned, partition_files
+from sketches import HyperLogLog, SpaceSaving, StratifiedReservoir, proportion, ratio
+
 INPUT_FILE = "oncology_trials_2022_2025.csv"
 
 # ---------------------------------------------------------------------------
@@ -183,217 +192,887 @@ def is_academic_facility(facility_name):
     return bool(ACADEMIC_RE.search(facility_name))
 
 
-def main():
-    trials = []
-    with open(INPUT_FILE, "r", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            row["_year"] = parse_year(row["start_date"])
-            row["_has_us"] = row["has_us_site"] == "True"
-            row["_countries"] = row["countries"].split("|") if row["countries"] else []
-            row["_facilities"] = row["facilities"].split("|") if row["facilities"] else []
-            row["_sponsor_tier"] = classify_sponsor(row["lead_sponsor"], row["lead_sponsor_class"])
-            trials.append(row)
-
-    years = sorted(set(t["_year"] for t in trials if t["_year"] and 2022 <= t["_year"] <= 2025))
+def prepare_row(row):
+    """Attach the parsed helper fields used by every report section."""
+    row["_year"] = parse_year(row["start_date"])
+    row["_has_us"] = row["has_us_site"] == "True"
+    row["_countries"] = row["countries"].split("|") if row["countries"] else []
+    row["_facilities"] = row["facilities"].split("|") if row["facilities"] else []
+    row["_sponsor_tier"] = classify_sponsor(row["lead_sponsor"], row["lead_sponsor_class"])
+    return row
+
+
+# ---------------------------------------------------------------------------
+# Aggregate cube
+#
+# Counts are kept per cell of year x phase x status x geography x sponsor
+# tier x site type, each cell holding [trials, academic sites, community
+# sites].  Every member trial's contribution is remembered so a refresh
+# only has to reclassify the nct_ids that were inserted, changed or removed.
+# For a partitioned dataset (see partitions.py) each member also records its
+# source partition, so partitions whose files did not move are not re-read.
+# ---------------------------------------------------------------------------
+CUBE_FILE = "oncology_trials_cube.json"
+CUBE_VERSION = 2
+CUBE_DIMENSIONS = ["year", "phase", "status", "geo", "sponsor_tier", "site_type"]
+
+# Columns that feed the cube; a row is only reclassified when one changes.
+CUBE_SOURCE_COLUMNS = [
+    "start_date",
+    "phase",
+    "overall_status",
+    "has_us_site",
+    "countries",
+    "facilities",
+    "lead_sponsor",
+    "lead_sponsor_class",
+]
+
+
+def classifier_fingerprint():
+    """Hash of the tier lists, academic patterns and code the cube was built with."""
+    h = hashlib.sha1()
+    for part in (sorted(LARGE_CAP), sorted(MID_MARKET), ACADEMIC_PATTERNS):
+        h.update("\x1f".join(part).encode())
+        h.update(b"\x1e")
+    for fn in CLASSIFIER_FUNCTIONS + CUBE_FUNCTIONS:
+        h.update(inspect.getsource(fn).encode())
+    h.update(str(CUBE_VERSION).encode())
+    return h.hexdigest()
+
+
+def input_fingerprint(path):
+    st = os.stat(path)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def row_stamp(row):
+    return hashlib.sha1("\x1f".join(row[c] for c in CUBE_SOURCE_COLUMNS).encode()).hexdigest()[:16]
+
+
+def geo_bucket(countries, has_us):
+    if not countries:
+        return "none"
+    if has_us and len(countries) == 1:
+        return "us_only"
+    if has_us:
+        return "us_intl"
+    return "non_us"
+
+
+def site_profile(facilities):
+    """Return (site_type, academic_sites, community_sites) for a trial."""
+    if not facilities:
+        return "none", 0, 0
+    acad_count = sum(1 for f in facilities if is_academic_facility(f))
+    comm_count = len(facilities) - acad_count
+    if acad_count > 0 and comm_count == 0:
+        return "academic", acad_count, comm_count
+    if acad_count == 0 and comm_count > 0:
+        return "community", acad_count, comm_count
+    return "mixed", acad_count, comm_count
+
+
+def trial_facts(row):
+    """Reduce a prepared row to its contribution to the cube."""
+    site_type, acad, comm = site_profile(row["_facilities"])
+    cell = [
+        str(row["_year"] or ""),
+        row["phase"],
+        row["overall_status"],
+        geo_bucket(row["_countries"], row["_has_us"]),
+        row["_sponsor_tier"] or "",
+        site_type,
+    ]
+    return {
+        "cell": "\t".join(cell),
+        "acad": acad,
+        "comm": comm,
+        "countries": row["_countries"],
+        "sponsor": row["lead_sponsor"],
+        "stamp": row_stamp(row),
+    }
+
+
+# Code whose output is stored in the cube; editing any of it forces a rebuild.
+CLASSIFIER_FUNCTIONS = [
+    parse_year,
+    classify_sponsor,
+    is_academic_facility,
+    prepare_row,
+    row_stamp,
+    geo_bucket,
+    site_profile,
+    trial_facts,
+]
+
+
+def new_cube():
+    return {
+        "version": CUBE_VERSION,
+        "classifier": classifier_fingerprint(),
+        "inputs": {},
+        "cells": {},
+        "countries": {},
+        "sponsors": {"large_cap": {}, "mid_market": {}, "emerging": {}},
+        "members": {},
+    }
+
+
+def _bump(counts, key, delta):
+    value = counts.get(key, 0) + delta
+    if value:
+        counts[key] = value
+    else:
+        counts.pop(key, None)
+
+
+def _cube_apply(cube, facts, sign):
+    cell = cube["cells"].setdefault(facts["cell"], [0, 0, 0])
+    cell[0] += sign
+    cell[1] += sign * facts["acad"]
+    cell[2] += sign * facts["comm"]
+    if not cell[0]:
+        del cube["cells"][facts["cell"]]
+    for c in facts["countries"]:
+        _bump(cube["countries"], c, sign)
+    tier = facts["cell"].split("\t")[4]
+    if tier:
+        _bump(cube["sponsors"][tier], facts["sponsor"], sign)
+
+
+def apply_delta(cube, upserts=(), removed=()):
+    """Apply inserted/updated trials and removed nct_ids to the cube.
+
+    ``upserts`` is an iterable of (nct_id, facts) pairs as produced by
+    trial_facts(); an existing member is retracted before it is re-added.
+    """
+    members = cube["members"]
+    for nct_id in removed:
+        old = members.pop(nct_id, None)
+        if old is not None:
+            _cube_apply(cube, old, -1)
+    for nct_id, facts in upserts:
+        old = members.get(nct_id)
+        if old is not None:
+            _cube_apply(cube, old, -1)
+        _cube_apply(cube, facts, +1)
+        members[nct_id] = facts
+    return cube
+
+
+def load_cube(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            cube = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if cube.get("version") != CUBE_VERSION or cube.get("classifier") != classifier_fingerprint():
+        return None
+    return cube
+
+
+def save_json(obj, path):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(obj, f, separators=(",", ":"))
+    os.replace(tmp, path)
+
+
+def input_sources(path, years=None):
+    """Return the CSV files behind ``path``.
+
+    A partitioned dataset directory is pruned to the partitions that can
+    hold trials starting in ``years`` (all partitions when None); a plain
+    CSV is returned as is.
+    """
+    if os.path.isdir(path):
+        if not is_partitioned(path):
+            raise FileNotFoundError(f"{path} is a directory without a partition manifest")
+        return partition_files(path, years)
+    return [path]
+
+
+def selection_label(years):
+    """Short name for a --years selection, e.g. "2022-2025" or "all"."""
+    if years is None:
+        return "all"
+    years = sorted(years)
+    if years == list(range(years[0], years[-1] + 1)):
+        return f"{years[0]}-{years[-1]}" if len(years) > 1 else str(years[0])
+    return ",".join(map(str, years))
+
+
+def selection_cube_file(cube_file, years):
+    """Cube file for one --years selection of a partitioned dataset.
+
+    Each selection keeps its own cube, so a pruned run does not evict the
+    trials a wider run refreshed and vice versa.
+    """
+    stem, ext = os.path.splitext(cube_file)
+    return f"{stem}.{selection_label(years)}{ext}"
+
+
+def parse_years(spec):
+    """Parse "all", "2024" or "2022-2025" into a range of years (None for all)."""
+    if spec == "all":
+        return None
+    first, _, last = spec.partition("-")
+    years = range(int(first), int(last or first) + 1)
+    if not years:
+        raise ValueError(f"empty year range {spec!r}")
+    return years
+
+
+def refresh_cube(sources=INPUT_FILE, cube_file=CUBE_FILE, rebuild=False):
+    """Bring the cube in line with the source CSVs, touching only changed trials.
+
+    A CSV is not read at all when its size and mtime match the last
+    refresh; otherwise rows are compared by stamp and only inserted or
+    changed ones are reclassified.  A change to the tier lists or academic
+    patterns forces a full rebuild.
+    """
+    if isinstance(sources, str):
+        sources = [sources]
+    cube = None if rebuild else load_cube(cube_file)
+    if cube is None:
+        cube = new_cube()
+
+    fingerprints = {path: input_fingerprint(path) for path in sources}
+    if cube["inputs"] == fingerprints:
+        return cube, 0, 0
+    stale = {path for path in sources if cube["inputs"].get(path) != fingerprints[path]}
+
+    members = cube["members"]
+    seen = set()
+    upserts = []
+    for path in sources:
+        if path not in stale:
+            continue
+        with open(path, "r", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                nct_id = row["nct_id"]
+                seen.add(nct_id)
+                old = members.get(nct_id)
+                if old is not None and old["stamp"] == row_stamp(row):
+                    old["src"] = path
+                    continue
+                facts = trial_facts(prepare_row(row))
+                facts["src"] = path
+                upserts.append((nct_id, facts))
+    # Trials from unchanged sources were not read and are kept as they are.
+    removed = [
+        nct_id for nct_id, facts in members.items()
+        if nct_id not in seen and (facts["src"] in stale or facts["src"] not in fingerprints)
+    ]
+
+    apply_delta(cube, upserts, removed)
+    cube["inputs"] = fingerprints
+    save_json(cube, cube_file)
+    return cube, len(upserts), len(removed)
+
+
+# Code that maintains the stored cube; like CLASSIFIER_FUNCTIONS, an edit
+# invalidates every persisted cube.
+CUBE_FUNCTIONS = [input_sources, new_cube, _bump, _cube_apply, apply_delta, refresh_cube]
+
+
+def _decode_cell(key):
+    values = key.split("\t")
+    values[0] = int(values[0]) if values[0] else None
+    return values
+
+
+def slice_cube(cube, by, where=None, measure=0):
+    """Roll the cube up to the ``by`` dimensions.
+
+    ``where`` maps a dimension name to the collection of values to keep,
+    ``measure`` picks trials (0), academic sites (1) or community sites (2).
+    Returns a Counter keyed by a tuple of the ``by`` values (or the bare
+    value when a single dimension is given).
+    """
+    if isinstance(by, str):
+        by = [by]
+        single = True
+    else:
+        single = False
+    by_idx = [CUBE_DIMENSIONS.index(d) for d in by]
+    filters = [(CUBE_DIMENSIONS.index(d), vals) for d, vals in (where or {}).items()]
+
+    out = Counter()
+    for key, counts in cube["cells"].items():
+        values = _decode_cell(key)
+        if any(values[i] not in vals for i, vals in filters):
+            continue
+        group = values[by_idx[0]] if single else tuple(values[i] for i in by_idx)
+        out[group] += counts[measure]
+    return out
+
+
+TIERS = ["large_cap", "mid_market", "emerging"]
+YEAR_RANGE = range(2022, 2026)
+
+
+def report_data(cube):
+    """Compute the Q1-Q4 figures from the cube as plain dicts and lists."""
+    yr = {"year": YEAR_RANGE}
+    year_counts = slice_cube(cube, "year")
+    years = list(YEAR_RANGE)  # fixed columns, even when pruning left some years empty
+
+    def by_year(counter, value):
+        return {y: c for (v, y), c in counter.items() if v == value}
+
+    # Q1: volume by year and phase
+    phase_year = defaultdict(Counter)
+    for (phase, y), c in slice_cube(cube, ["phase", "year"], yr).items():
+        phase_year[phase or "Not specified"][y] += c
+
+    # Q2: geography
+    geo_year = slice_cube(cube, ["geo", "year"], yr)
+
+    # Q3: US trials by site type, plus site-level counts
+    us_where = {"year": YEAR_RANGE, "geo": ("us_only", "us_intl")}
+    site_year = slice_cube(cube, ["site_type", "year"], us_where)
+
+    # Q4: industry sponsor tiers
+    tier_totals = slice_cube(cube, "sponsor_tier")
+    industry = sum(c for tier, c in tier_totals.items() if tier)
+    tier_year = {tier: {} for tier in TIERS}
+    for (tier, y), c in slice_cube(cube, ["sponsor_tier", "year"], yr).items():
+        if tier:
+            tier_year[tier][y] = c
+
+    return {
+        "years": years,
+        "q1": {
+            "year_counts": {y: year_counts.get(y, 0) for y in years},
+            "phase_year": {phase: dict(ctr) for phase, ctr in phase_year.items()},
+        },
+        "q2": {
+            "us_only": by_year(geo_year, "us_only"),
+            "us_intl": by_year(geo_year, "us_intl"),
+            "non_us": by_year(geo_year, "non_us"),
+            "no_location": by_year(geo_year, "none"),
+            "top_countries": Counter(cube["countries"]).most_common(15),
+        },
+        "q3": {
+            "academic": by_year(site_year, "academic"),
+            "community": by_year(site_year, "community"),
+            "mixed": by_year(site_year, "mixed"),
+            "no_facility": by_year(site_year, "none"),
+            "academic_sites": dict(slice_cube(cube, "year", us_where, measure=1)),
+            "community_sites": dict(slice_cube(cube, "year", us_where, measure=2)),
+        },
+        "q4": {
+            "industry": industry,
+            "non_industry": sum(tier_totals.values()) - industry,
+            "tier_year": tier_year,
+            "top_sponsors": {tier: Counter(cube["sponsors"][tier]).most_common(10) for tier in TIERS},
+        },
+    }
+
+
+def format_report(data):
+    """Render report_data() output as the Q1-Q4 text report."""
+    lines = []
+    emit = lines.append
+    years = data["years"]
 
     # ======================================================================
     # Q1: How did the number of trials change over the years?
     # ======================================================================
-    print("=" * 70)
-    print("Q1: TRIAL VOLUME BY YEAR")
-    print("=" * 70)
-    year_counts = Counter(t["_year"] for t in trials if t["_year"])
+    q1 = data["q1"]
+    emit("=" * 70)
+    emit("Q1: TRIAL VOLUME BY YEAR")
+    emit("=" * 70)
     for y in years:
-        c = year_counts[y]
+        c = q1["year_counts"][y]
         bar = "█" * (c // 100)
-        print(f"  {y}:  {c:>6,}  {bar}")
-    print()
+        emit(f"  {y}:  {c:>6,}  {bar}")
+    emit("")
 
     # By phase
-    print("  By phase:")
-    phase_year = defaultdict(lambda: Counter())
-    for t in trials:
-        if t["_year"] and 2022 <= t["_year"] <= 2025:
-            phase = t["phase"] if t["phase"] else "Not specified"
-            phase_year[phase][t["_year"]] += 1
-
+    emit("  By phase:")
+    phase_year = q1["phase_year"]
     phase_order = ["EARLY_PHASE1", "PHASE1", "PHASE1|PHASE2", "PHASE2", "PHASE2|PHASE3", "PHASE3", "PHASE4", "NA", "Not specified"]
-    print(f"  {'Phase':<20} {'2022':>7} {'2023':>7} {'2024':>7} {'2025':>7}")
-    print(f"  {'-'*20} {'-'*7} {'-'*7} {'-'*7} {'-'*7}")
+    emit(f"  {'Phase':<20} {'2022':>7} {'2023':>7} {'2024':>7} {'2025':>7}")
+    emit(f"  {'-'*20} {'-'*7} {'-'*7} {'-'*7} {'-'*7}")
     for phase in phase_order:
         if phase in phase_year:
             vals = [phase_year[phase].get(y, 0) for y in years]
-            print(f"  {phase:<20} {vals[0]:>7,} {vals[1]:>7,} {vals[2]:>7,} {vals[3]:>7,}")
-    print()
+            emit(f"  {phase:<20} {vals[0]:>7,} {vals[1]:>7,} {vals[2]:>7,} {vals[3]:>7,}")
+    emit("")
 
     # ======================================================================
     # Q2: US vs outside US over the years
     # ======================================================================
-    print("=" * 70)
-    print("Q2: US vs NON-US TRIALS BY YEAR")
-    print("=" * 70)
-    us_year = Counter()
-    nonus_year = Counter()
-    both_year = Counter()
-    no_location_year = Counter()
-
-    for t in trials:
-        y = t["_year"]
-        if not y or y not in range(2022, 2026):
-            continue
-        countries = t["_countries"]
-        has_us = t["_has_us"]
-        if not countries:
-            no_location_year[y] += 1
-        elif has_us and len(countries) == 1:
-            us_year[y] += 1
-        elif has_us and len(countries) > 1:
-            both_year[y] += 1
-        else:
-            nonus_year[y] += 1
+    q2 = data["q2"]
+    emit("=" * 70)
+    emit("Q2: US vs NON-US TRIALS BY YEAR")
+    emit("=" * 70)
+    us_year = q2["us_only"]
+    both_year = q2["us_intl"]
+    nonus_year = q2["non_us"]
 
-    print(f"  {'Category':<25} {'2022':>7} {'2023':>7} {'2024':>7} {'2025':>7}")
-    print(f"  {'-'*25} {'-'*7} {'-'*7} {'-'*7} {'-'*7}")
-    for label, ctr in [("US only", us_year), ("US + international", both_year), ("Non-US only", nonus_year), ("No location data", no_location_year)]:
+    emit(f"  {'Category':<25} {'2022':>7} {'2023':>7} {'2024':>7} {'2025':>7}")
+    emit(f"  {'-'*25} {'-'*7} {'-'*7} {'-'*7} {'-'*7}")
+    for label, ctr in [("US only", us_year), ("US + international", both_year), ("Non-US only", nonus_year), ("No location data", q2["no_location"])]:
         vals = [ctr.get(y, 0) for y in years]
-        print(f"  {label:<25} {vals[0]:>7,} {vals[1]:>7,} {vals[2]:>7,} {vals[3]:>7,}")
-    print()
+        emit(f"  {label:<25} {vals[0]:>7,} {vals[1]:>7,} {vals[2]:>7,} {vals[3]:>7,}")
+    emit("")
 
     # US involvement total (US only + US+international)
-    print("  US involvement (any US site):")
+    emit("  US involvement (any US site):")
     for y in years:
-        us_total = us_year[y] + both_year[y]
-        nonus_total = nonus_year[y]
+        us_total = us_year.get(y, 0) + both_year.get(y, 0)
+        nonus_total = nonus_year.get(y, 0)
         total_with_loc = us_total + nonus_total
         pct = (us_total / total_with_loc * 100) if total_with_loc else 0
-        print(f"    {y}: {us_total:>5,} US ({pct:.1f}%)  |  {nonus_total:>5,} non-US")
-    print()
+        emit(f"    {y}: {us_total:>5,} US ({pct:.1f}%)  |  {nonus_total:>5,} non-US")
+    emit("")
 
     # Top non-US countries
-    print("  Top 15 countries by trial count (all years):")
-    country_counts = Counter()
-    for t in trials:
-        for c in t["_countries"]:
-            country_counts[c] += 1
-    for country, cnt in country_counts.most_common(15):
-        print(f"    {country:<30} {cnt:>6,}")
-    print()
+    emit("  Top 15 countries by trial count (all years):")
+    for country, cnt in q2["top_countries"]:
+        emit(f"    {country:<30} {cnt:>6,}")
+    emit("")
 
     # ======================================================================
     # Q3: US trials - academic vs community sites
     # ======================================================================
-    print("=" * 70)
-    print("Q3: US TRIALS - ACADEMIC vs COMMUNITY SITES")
-    print("=" * 70)
-
-    us_trials = [t for t in trials if t["_has_us"] and t["_year"] and 2022 <= t["_year"] <= 2025]
-
-    acad_year = Counter()
-    comm_year = Counter()
-    mixed_year = Counter()
-    no_facility_year = Counter()
-
-    # For site-level counts
-    acad_sites_year = Counter()
-    comm_sites_year = Counter()
-
-    for t in us_trials:
-        y = t["_year"]
-        facilities = t["_facilities"]
-        if not facilities:
-            no_facility_year[y] += 1
-            continue
-
-        acad_count = sum(1 for f in facilities if is_academic_facility(f))
-        comm_count = len(facilities) - acad_count
-
-        acad_sites_year[y] += acad_count
-        comm_sites_year[y] += comm_count
-
-        if acad_count > 0 and comm_count == 0:
-            acad_year[y] += 1
-        elif acad_count == 0 and comm_count > 0:
-            comm_year[y] += 1
-        else:
-            mixed_year[y] += 1
+    q3 = data["q3"]
+    emit("=" * 70)
+    emit("Q3: US TRIALS - ACADEMIC vs COMMUNITY SITES")
+    emit("=" * 70)
 
-    print(f"\n  Trial classification (by whether sites are academic, community, or mixed):")
-    print(f"  {'Category':<30} {'2022':>7} {'2023':>7} {'2024':>7} {'2025':>7}")
-    print(f"  {'-'*30} {'-'*7} {'-'*7} {'-'*7} {'-'*7}")
+    emit(f"\n  Trial classification (by whether sites are academic, community, or mixed):")
+    emit(f"  {'Category':<30} {'2022':>7} {'2023':>7} {'2024':>7} {'2025':>7}")
+    emit(f"  {'-'*30} {'-'*7} {'-'*7} {'-'*7} {'-'*7}")
     for label, ctr in [
-        ("Academic sites only", acad_year),
-        ("Community sites only", comm_year),
-        ("Mixed (academic + community)", mixed_year),
-        ("No facility data", no_facility_year),
+        ("Academic sites only", q3["academic"]),
+        ("Community sites only", q3["community"]),
+        ("Mixed (academic + community)", q3["mixed"]),
+        ("No facility data", q3["no_facility"]),
     ]:
         vals = [ctr.get(y, 0) for y in years]
-        print(f"  {label:<30} {vals[0]:>7,} {vals[1]:>7,} {vals[2]:>7,} {vals[3]:>7,}")
+        emit(f"  {label:<30} {vals[0]:>7,} {vals[1]:>7,} {vals[2]:>7,} {vals[3]:>7,}")
 
-    print(f"\n  Site-level counts (individual US sites across all trials):")
-    print(f"  {'Site type':<20} {'2022':>7} {'2023':>7} {'2024':>7} {'2025':>7}")
-    print(f"  {'-'*20} {'-'*7} {'-'*7} {'-'*7} {'-'*7}")
+    acad_sites_year = q3["academic_sites"]
+    comm_sites_year = q3["community_sites"]
+    emit(f"\n  Site-level counts (individual US sites across all trials):")
+    emit(f"  {'Site type':<20} {'2022':>7} {'2023':>7} {'2024':>7} {'2025':>7}")
+    emit(f"  {'-'*20} {'-'*7} {'-'*7} {'-'*7} {'-'*7}")
     for label, ctr in [("Academic", acad_sites_year), ("Community", comm_sites_year)]:
         vals = [ctr.get(y, 0) for y in years]
-        print(f"  {label:<20} {vals[0]:>7,} {vals[1]:>7,} {vals[2]:>7,} {vals[3]:>7,}")
+        emit(f"  {label:<20} {vals[0]:>7,} {vals[1]:>7,} {vals[2]:>7,} {vals[3]:>7,}")
 
     for y in years:
-        total_sites = acad_sites_year[y] + comm_sites_year[y]
+        total_sites = acad_sites_year.get(y, 0) + comm_sites_year.get(y, 0)
         if total_sites:
-            pct = acad_sites_year[y] / total_sites * 100
-            print(f"    {y}: Academic share = {pct:.1f}%")
-    print()
+            pct = acad_sites_year.get(y, 0) / total_sites * 100
+            emit(f"    {y}: Academic share = {pct:.1f}%")
+    emit("")
 
     # ======================================================================
     # Q4: Industry trials by sponsor tier
     # ======================================================================
-    print("=" * 70)
-    print("Q4: INDUSTRY ONCOLOGY TRIALS BY SPONSOR TIER")
-    print("=" * 70)
-
-    industry_trials = [t for t in trials if t["_sponsor_tier"] is not None]
-    non_industry = len(trials) - len(industry_trials)
-
-    tier_year = defaultdict(Counter)
-    for t in industry_trials:
-        y = t["_year"]
-        if y and 2022 <= y <= 2025:
-            tier_year[t["_sponsor_tier"]][y] += 1
-
-    print(f"\n  Overall: {len(industry_trials):,} industry-sponsored  |  {non_industry:,} non-industry (academic/govt/other)")
-    print()
-    print(f"  {'Sponsor tier':<20} {'2022':>7} {'2023':>7} {'2024':>7} {'2025':>7}  {'Total':>7}")
-    print(f"  {'-'*20} {'-'*7} {'-'*7} {'-'*7} {'-'*7}  {'-'*7}")
-    for tier in ["large_cap", "mid_market", "emerging"]:
+    q4 = data["q4"]
+    emit("=" * 70)
+    emit("Q4: INDUSTRY ONCOLOGY TRIALS BY SPONSOR TIER")
+    emit("=" * 70)
+
+    tier_year = q4["tier_year"]
+    emit(f"\n  Overall: {q4['industry']:,} industry-sponsored  |  {q4['non_industry']:,} non-industry (academic/govt/other)")
+    emit("")
+    emit(f"  {'Sponsor tier':<20} {'2022':>7} {'2023':>7} {'2024':>7} {'2025':>7}  {'Total':>7}")
+    emit(f"  {'-'*20} {'-'*7} {'-'*7} {'-'*7} {'-'*7}  {'-'*7}")
+    for tier in TIERS:
         vals = [tier_year[tier].get(y, 0) for y in years]
         total = sum(vals)
         label = tier.replace("_", " ").title()
-        print(f"  {label:<20} {vals[0]:>7,} {vals[1]:>7,} {vals[2]:>7,} {vals[3]:>7,}  {total:>7,}")
-    print()
+        emit(f"  {label:<20} {vals[0]:>7,} {vals[1]:>7,} {vals[2]:>7,} {vals[3]:>7,}  {total:>7,}")
+    emit("")
 
     # Share of industry trials
-    print("  Share of industry trials by tier:")
+    emit("  Share of industry trials by tier:")
     for y in years:
-        total_ind = sum(tier_year[tier][y] for tier in tier_year)
+        total_ind = sum(tier_year[tier].get(y, 0) for tier in TIERS)
         if total_ind:
             parts = []
-            for tier in ["large_cap", "mid_market", "emerging"]:
-                pct = tier_year[tier][y] / total_ind * 100
+            for tier in TIERS:
+                pct = tier_year[tier].get(y, 0) / total_ind * 100
                 parts.append(f"{tier.replace('_',' ').title()}: {pct:.1f}%")
-            print(f"    {y}: {' | '.join(parts)}")
-    print()
+            emit(f"    {y}: {' | '.join(parts)}")
+    emit("")
 
     # Top sponsors in each tier
-    for tier in ["large_cap", "mid_market", "emerging"]:
-        sponsor_counts = Counter()
-        for t in industry_trials:
-            if t["_sponsor_tier"] == tier:
-                sponsor_counts[t["lead_sponsor"]] += 1
+    for tier in TIERS:
         label = tier.replace("_", " ").title()
-        print(f"  Top {label} sponsors:")
-        for name, cnt in sponsor_counts.most_common(10):
-            print(f"    {name:<50} {cnt:>5,}")
-        print()
+        emit(f"  Top {label} sponsors:")
+        for name, cnt in q4["top_sponsors"][tier]:
+            emit(f"    {name:<50} {cnt:>5,}")
+        emit("")
+
+    return "\n".join(lines)
+
+
+# ---------------------------------------------------------------------------
+# Approximate preview (--approx)
+#
+# One streaming pass that never holds the cohort in memory: start years are
+# counted exactly, everything that needs classification is estimated from a
+# per-year reservoir sample, distinct sites/sponsors come from HyperLogLog
+# and the top-N lists from space-saving counters.  Every estimate is stored
+# as [value, error] where error is a 95% bound (or, for top-N counts, the
+# most the count can overstate).
+# ---------------------------------------------------------------------------
+APPROX_SAMPLE = 2000  # sampled trials per start year
+APPROX_FIELDS = ["phase", "countries", "has_us_site", "facilities", "lead_sponsor", "lead_sponsor_class"]
+
+
+def _estimate(hits, n, population):
+    share, err = proportion(hits, n, population)
+    return [round(share * population), round(err * population)]
+
+
+def _ratio_pct(numerators, denominators, population):
+    share, err = ratio(numerators, denominators, population)
+    return [round(share * 100, 1), round(err * 100, 1)]
+
+
+def _distinct(hll):
+    est = hll.estimate()
+    return [est, round(est * 2 * hll.relative_error())]
+
+
+def approx_data(sources=INPUT_FILE, sample_size=APPROX_SAMPLE, seed=None):
+    """Estimate the Q1-Q4 figures from one pass with sampling and sketches."""
+    if isinstance(sources, str):
+        sources = [sources]
+    reservoir = StratifiedReservoir(sample_size, seed)
+    distinct_sites = HyperLogLog()
+    distinct_sponsors = HyperLogLog()
+    top_countries = SpaceSaving(256)
+    top_industry = SpaceSaving(1000)
+    total = 0
+
+    for path in sources:
+        with open(path, "r", encoding="utf-8") as f:
+            reader = csv.reader(f)
+            col = {name: i for i, name in enumerate(next(reader))}
+            i_start = col["start_date"]
+            i_countries = col["countries"]
+            i_facilities = col["facilities"]
+            i_sponsor = col["lead_sponsor"]
+            i_class = col["lead_sponsor_class"]
+            keep = [col[name] for name in APPROX_FIELDS]
+            for rec in reader:
+                total += 1
+                if rec[i_countries]:
+                    for c in rec[i_countries].split("|"):
+                        top_countries.add(c)
+                if rec[i_facilities]:
+                    for fac in rec[i_facilities].split("|"):
+                        distinct_sites.add(fac)
+                if rec[i_sponsor]:
+                    distinct_sponsors.add(rec[i_sponsor])
+                    if rec[i_class] == "INDUSTRY":
+                        top_industry.add(rec[i_sponsor])
+                year = parse_year(rec[i_start])
+                if year in YEAR_RANGE:
+                    reservoir.add(year, [rec[i] for i in keep])
+
+    years = sorted(reservoir.seen)
+    phase_year = defaultdict(dict)
+    geo = {g: {} for g in ("us_only", "us_intl", "non_us", "none")}
+    us_share = {}
+    site_types = {s: {} for s in ("academic", "community", "mixed", "none")}
+    academic_site_share = {}
+    tiers = {tier: {} for tier in TIERS}
+    tier_share = {tier: {} for tier in TIERS}
+
+    for y in years:
+        population = reservoir.seen[y]
+        sample = [prepare_row(dict(zip(APPROX_FIELDS, values), start_date=str(y)))
+                  for values in reservoir.samples[y]]
+        n = len(sample)
+
+        phases = Counter(t["phase"] or "Not specified" for t in sample)
+        for phase, hits in phases.items():
+            phase_year[phase][y] = _estimate(hits, n, population)
+
+        # Subgroup shares (US trials, industry trials) are ratios over the
+        # whole year sample, so their bounds include the variance of the
+        # subgroup's own size.
+        geos = [geo_bucket(t["_countries"], t["_has_us"]) for t in sample]
+        buckets = Counter(geos)
+        for g in geo:
+            geo[g][y] = _estimate(buckets[g], n, population)
+        us_share[y] = _ratio_pct(
+            [g in ("us_only", "us_intl") for g in geos], [g != "none" for g in geos], population
+        )
+
+        profiles = [site_profile(t["_facilities"]) if t["_has_us"] else (None, 0, 0) for t in sample]
+        kinds = Counter(kind for kind, _, _ in profiles)
+        for kind in site_types:
+            site_types[kind][y] = _estimate(kinds[kind], n, population)
+        academic_site_share[y] = _ratio_pct([a for _, a, _ in profiles], [a + c for _, a, c in profiles], population)
+
+        tiers_sampled = [t["_sponsor_tier"] for t in sample]
+        tier_counts = Counter(tiers_sampled)
+        for tier in TIERS:
+            tiers[tier][y] = _estimate(tier_counts[tier], n, population)
+            tier_share[tier][y] = _ratio_pct(
+                [st == tier for st in tiers_sampled], [bool(st) for st in tiers_sampled], population
+            )
+
+    top_sponsors = {tier: [] for tier in TIERS}
+    for name, count, err in top_industry.most_common(top_industry.capacity):
+        tier = classify_sponsor(name, "INDUSTRY")
+        if len(top_sponsors[tier]) < 10:
+            top_sponsors[tier].append([name, count, err])
+
+    return {
+        "approximate": True,
+        "trials": total,
+        "sample_per_year": sample_size,
+        "years": years,
+        "q1": {
+            "year_counts": {y: reservoir.seen[y] for y in years},
+            "sampled": {y: len(reservoir.samples[y]) for y in years},
+            "phase_year": dict(phase_year),
+        },
+        "q2": {
+            **geo,
+            "us_share_pct": us_share,
+            "top_countries": [list(t) for t in top_countries.most_common(15)],
+        },
+        "q3": {
+            **site_types,
+            "academic_site_share_pct": academic_site_share,
+            "distinct_sites": _distinct(distinct_sites),
+        },
+        "q4": {
+            "tier_year": tiers,
+            "tier_share_pct": tier_share,
+            "distinct_sponsors": _distinct(distinct_sponsors),
+            "top_sponsors": top_sponsors,
+        },
+    }
+
+
+def format_approx_report(data):
+    """Render approx_data() output; each cell is estimate ± error."""
+    lines = []
+    emit = lines.append
+    years = data["years"]
+
+    def cells(values, fmt="{:,}"):
+        return " ".join(
+            f"{fmt.format(v[0]) + ' ±' + fmt.format(v[1]):>15}" if v else f"{'-':>15}"
+            for v in (values.get(y) for y in years)
+        )
+
+    header = " ".join(f"{y:>15}" for y in years)
+    rule = " ".join("-" * 15 for _ in years)
+
+    emit("=" * 70)
+    emit(f"APPROXIMATE PREVIEW: {data['trials']:,} trials, up to {data['sample_per_year']:,} sampled per start year")
+    emit("Estimates are value ± 95% bound; top-N counts may overstate by at most +error.")
+    emit("=" * 70)
+
+    q1 = data["q1"]
+    emit("Q1: TRIAL VOLUME BY YEAR (exact)")
+    for y in years:
+        c = q1["year_counts"][y]
+        emit(f"  {y}:  {c:>6,}  (sampled {q1['sampled'][y]:,})")
+    emit("")
+    emit("  By phase (estimated):")
+    emit(f"  {'Phase':<20} {header}")
+    emit(f"  {'-'*20} {rule}")
+    phase_order = ["EARLY_PHASE1", "PHASE1", "PHASE1|PHASE2", "PHASE2", "PHASE2|PHASE3", "PHASE3", "PHASE4", "NA", "Not specified"]
+    for phase in phase_order + sorted(set(q1["phase_year"]) - set(phase_order)):
+        if phase in q1["phase_year"]:
+            emit(f"  {phase:<20} {cells(q1['phase_year'][phase])}")
+    emit("")
+
+    q2 = data["q2"]
+    emit("=" * 70)
+    emit("Q2: US vs NON-US TRIALS BY YEAR (estimated)")
+    emit("=" * 70)
+    emit(f"  {'Category':<20} {header}")
+    emit(f"  {'-'*20} {rule}")
+    for label, key in [("US only", "us_only"), ("US + international", "us_intl"), ("Non-US only", "non_us"), ("No location data", "none")]:
+        emit(f"  {label:<20} {cells(q2[key])}")
+    emit(f"  {'US share % (located)':<20} {cells(q2['us_share_pct'], '{:.1f}')}")
+    emit("")
+    emit("  Top 15 countries by trial count (all years):")
+    for country, cnt, err in q2["top_countries"]:
+        emit(f"    {country:<30} {cnt:>6,}  (+≤{err:,})")
+    emit("")
+
+    q3 = data["q3"]
+    emit("=" * 70)
+    emit("Q3: US TRIALS - ACADEMIC vs COMMUNITY SITES (estimated)")
+    emit("=" * 70)
+    emit(f"  {'Category':<20} {header}")
+    emit(f"  {'-'*20} {rule}")
+    for label, key in [("Academic only", "academic"), ("Community only", "community"), ("Mixed", "mixed"), ("No facility data", "none")]:
+        emit(f"  {label:<20} {cells(q3[key])}")
+    emit(f"  {'Academic site %':<20} {cells(q3['academic_site_share_pct'], '{:.1f}')}")
+    est, err = q3["distinct_sites"]
+    emit(f"\n  Distinct facility names (all trials): ~{est:,} ±{err:,}")
+    emit("")
+
+    q4 = data["q4"]
+    emit("=" * 70)
+    emit("Q4: INDUSTRY ONCOLOGY TRIALS BY SPONSOR TIER (estimated)")
+    emit("=" * 70)
+    emit(f"  {'Sponsor tier':<20} {header}")
+    emit(f"  {'-'*20} {rule}")
+    for tier in TIERS:
+        emit(f"  {tier.replace('_', ' ').title():<20} {cells(q4['tier_year'][tier])}")
+    emit("")
+    emit("  Share of industry trials by tier (%):")
+    for tier in TIERS:
+        emit(f"  {tier.replace('_', ' ').title():<20} {cells(q4['tier_share_pct'][tier], '{:.1f}')}")
+    est, err = q4["distinct_sponsors"]
+    emit(f"\n  Distinct lead sponsors (all trials): ~{est:,} ±{err:,}")
+    emit("")
+    for tier in TIERS:
+        emit(f"  Top {tier.replace('_', ' ').title()} sponsors:")
+        for name, cnt, err in q4["top_sponsors"][tier]:
+            emit(f"    {name:<50} {cnt:>5,}  (+≤{err:,})")
+        emit("")
+
+    return "\n".join(lines)
+
+
+# ---------------------------------------------------------------------------
+# Report cache
+#
+# Rendered reports are cached per input file under a key built from the
+# input's content hash, the classifier lists and this module's source, so
+# any change to the data, the tier lists/patterns or the analysis code
+# invalidates them.  A code change that affects what the cube stores also
+# changes classifier_fingerprint(), so the miss rebuilds the cube instead of
+# re-rendering stale figures.  A file's content hash is only recomputed when its size
+# or mtime moved; for a partitioned dataset that is per selected partition.
+# ---------------------------------------------------------------------------
+REPORT_CACHE_FILE = "oncology_trials_report_cache.json"
+
+
+def code_fingerprint():
+    with open(os.path.abspath(__file__), "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def content_hash(path):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _load_report_cache(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def cached_report(input_file=INPUT_FILE, cube_file=CUBE_FILE, cache_file=REPORT_CACHE_FILE, rebuild=False,
+                  years=None):
+    """Return (text, data, hit) for input_file, reusing a cached report if still valid.
+
+    ``years`` prunes the partitions read from a partitioned dataset; each
+    selection is cached and cubed separately.
+    """
+    cache = _load_report_cache(cache_file)
+    sources = input_sources(input_file, years)
+    name = os.path.abspath(input_file)
+    if os.path.isdir(input_file):
+        name += "#" + selection_label(years)
+        cube_file = selection_cube_file(cube_file, years)
+    entry = None if rebuild else cache.get(name)  # other inputs' entries survive a rebuild
+
+    old_files = entry["files"] if entry else {}
+    files = {}
+    for path in sources:
+        stat = input_fingerprint(path)
+        old = old_files.get(path)
+        files[path] = {"stat": stat, "sha1": old["sha1"] if old and old["stat"] == stat else content_hash(path)}
+    digest = hashlib.sha1("\n".join(f"{p}:{f['sha1']}" for p, f in files.items()).encode()).hexdigest()
+    key = hashlib.sha1(f"{digest}:{classifier_fingerprint()}:{code_fingerprint()}".encode()).hexdigest()
+
+    if entry and entry["key"] == key:
+        if old_files != files:  # touched but identical; remember the new stats
+            entry["files"] = files
+            save_json(cache, cache_file)
+        return entry["text"], entry["data"], True
+
+    cube, changed, removed = refresh_cube(sources, cube_file, rebuild=rebuild)
+    if changed or removed:
+        print(f"Cube refreshed: {changed:,} trials added/updated, {removed:,} removed", file=sys.stderr)
+    data = report_data(cube)
+    text = format_report(data)
+    # Round-trip through JSON so a fresh report has the same shape as a cached one.
+    data = json.loads(json.dumps(data))
+    cache[name] = {"files": files, "key": key, "text": text, "data": data}
+    save_json(cache, cache_file)
+    return text, data, False
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--input", default=INPUT_FILE,
+        help=f"Exported trials CSV or partitioned dataset directory (default: {INPUT_FILE})",
+    )
+    parser.add_argument(
+        "--years", default=f"{YEAR_RANGE.start}-{YEAR_RANGE.stop - 1}",
+        help="Start years to read from a partitioned dataset, e.g. 2024 or 2022-2025, or 'all' "
+        f"(default: {YEAR_RANGE.start}-{YEAR_RANGE.stop - 1}; ignored for a single CSV)",
+    )
+    parser.add_argument(
+        "--cube", default=CUBE_FILE,
+        help=f"Aggregate cube file (default: {CUBE_FILE}); a partitioned dataset gets one per --years "
+        "selection, e.g. oncology_trials_cube.2022-2025.json",
+    )
+    parser.add_argument(
+        "--cache", default=REPORT_CACHE_FILE, help=f"Report cache file (default: {REPORT_CACHE_FILE})"
+    )
+    parser.add_argument("--rebuild", action="store_true", help="Ignore the cube and report cache and rebuild both")
+    parser.add_argument("--json", action="store_true", help="Print the structured report as JSON")
+    parser.add_argument(
+        "--approx", action="store_true",
+        help="Quick preview from sampling and sketches, with error bounds (skips the cube and cache)",
+    )
+    parser.add_argument(
+        "--sample", type=int, default=APPROX_SAMPLE,
+        help=f"Trials sampled per start year with --approx (default: {APPROX_SAMPLE})",
+    )
+    parser.add_argument("--seed", type=int, help="Random seed for --approx sampling")
+    args = parser.parse_args()
+    try:
+        years = parse_years(args.years)
+    except ValueError:
+        parser.error(f"--years must be a year or ascending range like 2024, 2022-2025 or all, got {args.years!r}")
+
+    try:
+        if args.approx:
+            data = approx_data(input_sources(args.input, years), args.sample, args.seed)
+            text = format_approx_report(data)
+        else:
+            text, data, _ = cached_report(args.input, args.cube, args.cache, rebuild=args.rebuild, years=years)
+    except FileNotFoundError as e:
+        sys.exit(str(e))
+    if args.json:
+        print(json.dumps(data, indent=2))
+    else:
+        print(text)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""Compressed archive of raw study JSON with a random-access NCT ID index.
+
+An archive is a directory of NDJSON segments.  Each segment is a run of
+independently compressed frames (gzip members or zstd frames) holding up to
+BLOCK_SIZE studies, so the segment is still a valid .gz/.zst stream for
+command-line tools while any frame can be decompressed on its own.
+
+index.tsv maps each nct_id to (segment, frame offset, frame length, line
+within frame, content hash).  It is append-only: a re-archived study gets a
+new line and the last entry for an nct_id wins.  Studies whose content is
+unchanged are not archived again, and compact_archive() (or
+``archive.py compact DIR``) rewrites only the live frames and index.
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import shutil
+
+try:
+    import zstandard
+except ImportError:  # optional; gzip archives work without it
+    zstandard = None
+
+MANIFEST_FILE = "archive.json"
+INDEX_FILE = "index.tsv"
+ARCHIVE_VERSION = 1
+
+BLOCK_SIZE = 64  # studies per compressed frame
+SEGMENT_BYTES = 256 * 1024 * 1024
+
+CODECS = {"gzip": ".ndjson.gz", "zstd": ".ndjson.zst"}
+
+
+def _compress(codec, data):
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=10).compress(data)
+    return gzip.compress(data, compresslevel=6)
+
+
+def _decompress(codec, data):
+    if codec == "zstd":
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+def _check_codec(codec):
+    if codec not in CODECS:
+        raise ValueError(f"Unknown archive codec {codec!r} (expected one of {', '.join(CODECS)})")
+    if codec == "zstd" and zstandard is None:
+        raise RuntimeError("zstd archives need the 'zstandard' package (pip install zstandard)")
+
+
+def study_nct_id(study):
+    return study.get("protocolSection", {}).get("identificationModule", {}).get("nctId", "")
+
+
+def _line_hash(line):
+    return hashlib.sha1(line.encode()).hexdigest()[:16]
+
+
+def _parse_index_line(line):
+    """Return (nct_id, (segment, offset, length, n), hash or None) for an index line."""
+    fields = line.rstrip("\n").split("\t")
+    nct_id, segment, offset, length, n = fields[:5]
+    return nct_id, (segment, int(offset), int(length), int(n)), fields[5] if len(fields) > 5 else None
+
+
+def load_frame(path, codec, segment, offset, length, lines):
+    """Decode selected lines of one frame without loading the index.
+
+    Used by worker processes that are handed frames by ArchiveReader.frames().
+    """
+    with open(os.path.join(path, segment), "rb") as f:
+        f.seek(offset)
+        frame = _decompress(codec, f.read(length)).decode().split("\n")
+    return [json.loads(frame[n]) for n in lines]
+
+
+class ArchiveWriter:
+    """Append raw studies to an archive directory, creating it if needed.
+
+    A study identical to its latest archived version is skipped.
+    """
+
+    def __init__(self, path, codec="gzip", block_size=BLOCK_SIZE, segment_bytes=SEGMENT_BYTES):
+        os.makedirs(path, exist_ok=True)
+        manifest_path = os.path.join(path, MANIFEST_FILE)
+        if os.path.exists(manifest_path):
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            codec = manifest["codec"]  # an existing archive keeps its codec
+        else:
+            manifest = {"version": ARCHIVE_VERSION, "codec": codec, "segments": []}
+        _check_codec(codec)
+
+        self.path = path
+        self.codec = codec
+        self.block_size = block_size
+        self.segment_bytes = segment_bytes
+        self.manifest = manifest
+        self.written = 0
+        self.skipped = 0
+        self._block = []
+        self._segment = None
+        self._hashes = {}
+        index_path = os.path.join(path, INDEX_FILE)
+        if os.path.exists(index_path):
+            with open(index_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    nct_id, _, digest = _parse_index_line(line)
+                    self._hashes[nct_id] = digest
+        self._index = open(index_path, "a", encoding="utf-8")
+        if manifest["segments"]:
+            self._open_segment(manifest["segments"][-1])
+
+    def _open_segment(self, name):
+        if self._segment is not None:
+            self._segment.close()
+        self._segment_name = name
+        self._segment = open(os.path.join(self.path, name), "ab")
+
+    def _next_segment(self):
+        name = f"segment-{len(self.manifest['segments']):05d}{CODECS[self.codec]}"
+        self.manifest["segments"].append(name)
+        self._save_manifest()
+        self._open_segment(name)
+
+    def _save_manifest(self):
+        tmp = os.path.join(self.path, MANIFEST_FILE + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(tmp, os.path.join(self.path, MANIFEST_FILE))
+
+    def add(self, study):
+        line = json.dumps(study, ensure_ascii=False, separators=(",", ":"))
+        nct_id = study_nct_id(study)
+        digest = _line_hash(line)
+        if self._hashes.get(nct_id) == digest:
+            self.skipped += 1
+            return
+        self._hashes[nct_id] = digest
+        self._block.append((nct_id, line, digest))
+        if len(self._block) >= self.block_size:
+            self.flush()
+
+    def flush(self):
+        if not self._block:
+            return
+        if self._segment is None or self._segment.tell() >= self.segment_bytes:
+            self._next_segment()
+
+        frame = _compress(self.codec, ("\n".join(line for _, line, _ in self._block) + "\n").encode())
+        offset = self._segment.tell()
+        self._segment.write(frame)
+        self._segment.flush()
+
+        # Only index frames that are fully on disk.
+        for n, (nct_id, _, digest) in enumerate(self._block):
+            self._index.write(f"{nct_id}\t{self._segment_name}\t{offset}\t{len(frame)}\t{n}\t{digest}\n")
+        self._index.flush()
+        self.written += len(self._block)
+        self._block = []
+
+    def close(self):
+        self.flush()
+        self._index.close()
+        if self._segment is not None:
+            self._segment.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ArchiveReader:
+    """Look up or iterate the latest archived version of each study.
+
+    The index is only parsed in full when it is needed; a single get()
+    just scans it for the one nct_id.
+    """
+
+    def __init__(self, path):
+        with open(os.path.join(path, MANIFEST_FILE), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        _check_codec(manifest["codec"])
+        self.path = path
+        self.codec = manifest["codec"]
+        self._index = None
+        self._files = {}
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = {}
+            with open(os.path.join(self.path, INDEX_FILE), "r", encoding="utf-8") as f:
+                for line in f:
+                    nct_id, entry, _ = _parse_index_line(line)
+                    self._index[nct_id] = entry
+        return self._index
+
+    def _find(self, nct_id):
+        if self._index is not None:
+            return self._index.get(nct_id)
+        prefix = nct_id + "\t"
+        found = None
+        with open(os.path.join(self.path, INDEX_FILE), "r", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith(prefix):
+                    found = line  # the last entry wins
+        return None if found is None else _parse_index_line(found)[1]
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, nct_id):
+        return nct_id in self.index
+
+    def _read_frame(self, segment, offset, length):
+        f = self._files.get(segment)
+        if f is None:
+            f = self._files[segment] = open(os.path.join(self.path, segment), "rb")
+        f.seek(offset)
+        return _decompress(self.codec, f.read(length)).decode().split("\n")
+
+    def get(self, nct_id):
+        """Return the archived study for nct_id, or None."""
+        entry = self._find(nct_id)
+        if entry is None:
+            return None
+        segment, offset, length, n = entry
+        return json.loads(self._read_frame(segment, offset, length)[n])
+
+    def frames(self):
+        """Yield (segment, offset, length, [line numbers]) for every live frame, in file order."""
+        frames = {}
+        for segment, offset, length, n in self.index.values():
+            frames.setdefault((segment, offset, length), []).append(n)
+        for (segment, offset, length), lines in sorted(frames.items()):
+            yield segment, offset, length, sorted(lines)
+
+    def read_frame(self, segment, offset, length, lines):
+        """Decode the given lines of one frame into study dicts."""
+        frame = self._read_frame(segment, offset, length)
+        return [json.loads(frame[n]) for n in lines]
+
+    def __iter__(self):
+        for frame in self.frames():
+            yield from self.read_frame(*frame)
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def compact_archive(path):
+    """Rewrite ``path`` keeping only the latest version of each study.
+
+    Live frames are copied in file order into a fresh archive that then
+    replaces the old one.  Returns (live studies, superseded lines dropped).
+    """
+    path = path.rstrip("/")
+    with open(os.path.join(path, INDEX_FILE), "r", encoding="utf-8") as f:
+        lines = sum(1 for _ in f)
+    tmp, old = path + ".compacting", path + ".old"
+    shutil.rmtree(tmp, ignore_errors=True)
+    with ArchiveReader(path) as reader:
+        with ArchiveWriter(tmp, codec=reader.codec) as writer:
+            for study in reader:
+                writer.add(study)
+    os.replace(path, old)
+    os.replace(tmp, path)
+    shutil.rmtree(old)
+    return writer.written, lines - writer.written
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    compact_parser = subparsers.add_parser("compact", help="Drop superseded study versions from an archive")
+    compact_parser.add_argument("archive_dir")
+    args = parser.parse_args()
+
+    live, dropped = compact_archive(args.archive_dir)
+    print(f"{args.archive_dir}: kept {live} studies, dropped {dropped} superseded versions")
+
+
+if __name__ == "__main__":
+    main()
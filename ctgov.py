@@ -2,14 +2,35 @@
 """CLI tool for querying the ClinicalTrials.gov API v2."""
 
 import argparse
+import http.client
+import http.server
+import io
 import json
+import os
+import queue
+import socket
 import sys
+import threading
 import time
+import urllib.error
 import urllib.parse
 import urllib.request
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from archive import ArchiveReader
 
 BASE_URL = "https://clinicaltrials.gov/api/v2"
 
+# Local daemon started by `ctgov.py serve`; CLI calls are forwarded to it
+# when it is listening.  Set CTGOV_DAEMON=0 to always go direct.
+DAEMON_HOST = "127.0.0.1"
+DAEMON_PORT = int(os.environ.get("CTGOV_DAEMON_PORT", "8765"))
+DAEMON_CONNECT_TIMEOUT = 1.0  # seconds; an unreachable daemon means going direct
+DAEMON_READ_TIMEOUT = 300.0  # the daemon may queue requests behind its rate limit
+
+REQUEST_INTERVAL = 1.2  # seconds between API requests (~50 req/min)
+
 VALID_STATUSES = [
     "RECRUITING",
     "NOT_YET_RECRUITING",
@@ -19,6 +40,12 @@ VALID_STATUSES = [
     "TERMINATED",
     "COMPLETED",
     "WITHDRAWN",
+    "AVAILABLE",
+    "NO_LONGER_AVAILABLE",
+    "TEMPORARILY_NOT_AVAILABLE",
+    "APPROVED_FOR_MARKETING",
+    "WITHHELD",
+    "UNKNOWN",
 ]
 
 VALID_PHASES = ["EARLY_PHASE1", "PHASE1", "PHASE2", "PHASE3", "PHASE4", "NA"]
@@ -31,19 +58,94 @@ VALID_SORT_FIELDS = [
 ]
 
 
-def api_request(endpoint, params=None):
-    """Make a GET request to the ClinicalTrials.gov API."""
-    url = f"{BASE_URL}{endpoint}"
-    if params:
-        params = {k: v for k, v in params.items() if v is not None}
-        url += "?" + urllib.parse.urlencode(params)
+class RateLimiter:
+    """Space calls at least ``interval`` seconds apart across threads."""
+
+    def __init__(self, interval=REQUEST_INTERVAL):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+_rate_limiter = RateLimiter()
+
+
+def _encode_params(params):
+    if not params:
+        return ""
+    params = {k: v for k, v in params.items() if v is not None}
+    return "?" + urllib.parse.urlencode(params)
 
+
+def _daemon_enabled():
+    return os.environ.get("CTGOV_DAEMON", "1") != "0"
+
+
+def _urlopen_json(url):
     req = urllib.request.Request(url)
     req.add_header("Accept", "application/json")
+    with urllib.request.urlopen(req) as resp:
+        return json.loads(resp.read().decode())
+
+
+def _daemon_json(endpoint, query):
+    """GET from the local daemon; return None when it cannot be reached.
 
+    Uses a plain connection, so http_proxy settings never route the call to
+    localhost through a proxy.  HTTP errors passed through by the daemon are
+    raised as urllib HTTPErrors like direct ones.
+    """
+    conn = http.client.HTTPConnection(DAEMON_HOST, DAEMON_PORT, timeout=DAEMON_CONNECT_TIMEOUT)
+    try:
+        try:
+            conn.connect()
+        except OSError:  # refused, timed out or unreachable: no daemon
+            return None
+        conn.sock.settimeout(DAEMON_READ_TIMEOUT)
+        try:
+            conn.request("GET", f"{endpoint}{query}", headers={"Accept": "application/json"})
+            resp = conn.getresponse()
+            body = resp.read()
+        except (OSError, http.client.HTTPException) as e:
+            reason = "timed out" if isinstance(e, socket.timeout) else e
+            print(f"ctgov daemon failed ({reason}); querying the API directly", file=sys.stderr)
+            return None
+    finally:
+        conn.close()
+    if resp.status != 200:
+        url = f"http://{DAEMON_HOST}:{DAEMON_PORT}{endpoint}{query}"
+        raise urllib.error.HTTPError(url, resp.status, resp.reason, resp.headers, io.BytesIO(body))
+    return json.loads(body.decode())
+
+
+def request_json(endpoint, params=None, limiter=None):
+    """GET an API endpoint as JSON, raising urllib errors instead of exiting.
+
+    Goes through the local daemon when one is running (it owns the rate
+    limit and cache), otherwise straight to the API, paced by ``limiter``
+    (default: this module's limiter).
+    """
+    query = _encode_params(params)
+    if _daemon_enabled():
+        data = _daemon_json(endpoint, query)
+        if data is not None:
+            return data
+    (limiter or _rate_limiter).wait()
+    return _urlopen_json(f"{BASE_URL}{endpoint}{query}")
+
+
+def api_request(endpoint, params=None):
+    """Make a GET request to the ClinicalTrials.gov API, exiting on errors."""
     try:
-        with urllib.request.urlopen(req) as resp:
-            return json.loads(resp.read().decode())
+        return request_json(endpoint, params)
     except urllib.error.HTTPError as e:
         body = e.read().decode() if e.readable() else ""
         print(f"HTTP {e.code}: {e.reason}", file=sys.stderr)
@@ -99,13 +201,19 @@ def format_study_summary(study):
     return "\n".join(lines)
 
 
-def cmd_search(args):
-    """Search for clinical trials."""
-    params = {
-        "format": "json",
-        "pageSize": args.page_size,
-    }
+def _parse_choices(value, valid, label, plural):
+    values = [v.strip().upper() for v in value.split(",")]
+    for v in values:
+        if v not in valid:
+            print(f"Invalid {label}: {v}", file=sys.stderr)
+            print(f"Valid {plural}: {', '.join(valid)}", file=sys.stderr)
+            sys.exit(1)
+    return values
+
 
+def search_params(args):
+    """Build the query/filter params shared by search and counts."""
+    params = {}
     if args.condition:
         params["query.cond"] = args.condition
     if args.intervention:
@@ -117,21 +225,20 @@ def cmd_search(args):
     if args.location:
         params["query.locn"] = args.location
     if args.status:
-        statuses = [s.strip().upper() for s in args.status.split(",")]
-        for s in statuses:
-            if s not in VALID_STATUSES:
-                print(f"Invalid status: {s}", file=sys.stderr)
-                print(f"Valid statuses: {', '.join(VALID_STATUSES)}", file=sys.stderr)
-                sys.exit(1)
-        params["filter.overallStatus"] = ",".join(statuses)
+        params["filter.overallStatus"] = ",".join(_parse_choices(args.status, VALID_STATUSES, "status", "statuses"))
     if args.phase:
-        phases = [p.strip().upper() for p in args.phase.split(",")]
-        for p in phases:
-            if p not in VALID_PHASES:
-                print(f"Invalid phase: {p}", file=sys.stderr)
-                print(f"Valid phases: {', '.join(VALID_PHASES)}", file=sys.stderr)
-                sys.exit(1)
-        params["filter.phase"] = ",".join(phases)
+        params["filter.phase"] = ",".join(_parse_choices(args.phase, VALID_PHASES, "phase", "phases"))
+    return params
+
+
+def cmd_search(args):
+    """Search for clinical trials."""
+    params = {
+        "format": "json",
+        "pageSize": args.page_size,
+        **search_params(args),
+    }
+
     if args.sort:
         params["sort"] = args.sort
 
@@ -148,7 +255,6 @@ def cmd_search(args):
             page_token = data.get("nextPageToken")
             if not page_token or (args.max_pages and pages_fetched >= args.max_pages):
                 break
-            time.sleep(1.2)  # respect rate limit
         print(json.dumps(all_studies, indent=2))
         return
 
@@ -183,8 +289,6 @@ def cmd_search(args):
                 print(f"... {remaining} more studies (use --max-pages to see more)")
             break
 
-        time.sleep(1.2)  # respect rate limit
-
     if total_shown == 0:
         print("No studies found.")
 
@@ -195,7 +299,15 @@ def cmd_study(args):
     if not nct_id.startswith("NCT"):
         nct_id = "NCT" + nct_id
 
-    data = api_request(f"/studies/{nct_id}", {"format": "json"})
+    data = None
+    if args.archive:
+        try:
+            with ArchiveReader(args.archive) as archive:
+                data = archive.get(nct_id)
+        except OSError as e:
+            print(f"Archive {args.archive} unavailable ({e}); querying the API", file=sys.stderr)
+    if data is None:
+        data = api_request(f"/studies/{nct_id}", {"format": "json"})
 
     if args.json:
         print(json.dumps(data, indent=2))
@@ -330,6 +442,276 @@ def cmd_study(args):
     print()
 
 
+# ---------------------------------------------------------------------------
+# Count pushdown
+#
+# Questions that only need counts per start year, phase and/or status are
+# answered by the API itself: one countTotal request per bucket with a
+# one-study page, instead of downloading every matching study.  Every plan
+# also counts the whole query as "(total)": trials with several phases
+# fall into more than one phase bucket, so bucket sums can exceed it.
+# ---------------------------------------------------------------------------
+TOTAL_LABEL = "(total)"
+PUSHDOWN_DIMENSIONS = ["year", "phase", "status"]
+
+# Dimensions analyze.py derives from row-level data; these need a full export.
+ROW_LEVEL_DIMENSIONS = ["geo", "sponsor_tier", "site_type", "country", "sponsor"]
+
+
+def _buckets(dim, base_params, years):
+    """Return [(label, filter.advanced clause, extra params)] for one dimension."""
+    if dim == "year":
+        return [
+            (str(y), f"AREA[StartDate]RANGE[{y}-01-01, {y}-12-31]", {})
+            for y in years
+        ]
+    if dim == "phase":
+        if base_params.get("filter.phase"):
+            return [(p, f"AREA[Phase]{p}", {}) for p in base_params["filter.phase"].split(",")]
+        return [(p, f"AREA[Phase]{p}", {}) for p in VALID_PHASES] + [("(no phase)", "AREA[Phase]MISSING", {})]
+    statuses = (
+        base_params["filter.overallStatus"].split(",")
+        if base_params.get("filter.overallStatus")
+        else VALID_STATUSES
+    )
+    return [(s, None, {"filter.overallStatus": s}) for s in statuses]
+
+
+def parse_year_range(spec):
+    """Parse "2024" or "2022-2025" into a range of start years."""
+    first, _, last = spec.partition("-")
+    try:
+        years = range(int(first), int(last or first) + 1)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected a year or range like 2022-2025, got {spec!r}")
+    if not years:
+        raise argparse.ArgumentTypeError(f"empty year range {spec!r}")
+    return years
+
+
+def plan_counts(base_params, dims, years):
+    """Plan one count request per combination of buckets of ``dims``, plus a total.
+
+    Every request is limited to start years in ``years``.  Returns a list of
+    (labels, params).  Raises ValueError when a dimension cannot be pushed
+    down and needs row-level data instead.
+    """
+    row_level = [d for d in dims if d not in PUSHDOWN_DIMENSIONS]
+    if row_level:
+        raise ValueError(
+            f"{', '.join(row_level)} need row-level data; export with fetch_oncology.py "
+            f"and use analyze.py (count-only dimensions: {', '.join(PUSHDOWN_DIMENSIONS)})"
+        )
+
+    count_params = {"format": "json", "countTotal": "true", "pageSize": 1, "fields": "NCTId"}
+    base = {**base_params, **count_params}
+    if "phase" in dims:
+        base.pop("filter.phase", None)
+    if "status" in dims:
+        base.pop("filter.overallStatus", None)
+    scope = f"AREA[StartDate]RANGE[{years[0]}-01-01, {years[-1]}-12-31]"
+
+    # The year dimension brings its own per-year clauses.
+    plan = [((), [] if "year" in dims else [scope], {})]
+    for dim in dims:
+        plan = [
+            (labels + (label,), clauses + ([clause] if clause else []), {**extra, **more})
+            for labels, clauses, extra in plan
+            for label, clause, more in _buckets(dim, base_params, years)
+        ]
+    requests = [(labels, _with_clauses({**base, **extra}, clauses)) for labels, clauses, extra in plan]
+    requests.append(((TOTAL_LABEL,), _with_clauses({**base_params, **count_params}, [scope])))
+    return requests
+
+
+def _with_clauses(params, clauses):
+    """AND ``clauses`` onto any filter.advanced already in ``params``."""
+    if params.get("filter.advanced"):
+        clauses = [params["filter.advanced"]] + clauses
+    if clauses:
+        params["filter.advanced"] = " AND ".join(f"({c})" if len(clauses) > 1 else c for c in clauses)
+    return params
+
+
+def run_count_plan(plan, workers=4):
+    """Issue the planned count requests concurrently; return {labels: count}."""
+
+    def count(item):
+        labels, params = item
+        return labels, api_request("/studies", params).get("totalCount", 0)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return dict(pool.map(count, plan))
+
+
+def cmd_counts(args):
+    """Count trials per start year, phase and/or status without downloading them."""
+    dims = [d.strip().lower() for d in args.by.split(",") if d.strip()]
+    try:
+        plan = plan_counts(search_params(args), dims, args.years)
+    except ValueError as e:
+        print(str(e), file=sys.stderr)
+        sys.exit(1)
+    counts = run_count_plan(plan, args.workers)
+
+    if args.json:
+        print(json.dumps({"|".join(labels): n for labels, n in counts.items()}, indent=2))
+        return
+
+    print(f"{len(plan)} count requests\n")
+    header = "  ".join(f"{d.title():<24}" for d in dims)
+    print(f"{header}  {'Trials':>8}")
+    print(f"{'-' * len(header)}  {'-' * 8}")
+    for labels, n in counts.items():
+        row = "  ".join(f"{label:<24}" for label in labels)
+        print(f"{row}  {n:>8,}")
+
+
+class ResponseCache:
+    """Small LRU cache of successful API responses with a TTL."""
+
+    def __init__(self, ttl, max_entries=5000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, body = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return body
+
+    def put(self, key, body):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class UpstreamPool:
+    """Keep-alive HTTPS connections to the API host, reused across requests."""
+
+    def __init__(self, base_url=BASE_URL, size=4, timeout=60):
+        parts = urllib.parse.urlsplit(base_url)
+        self.conn_class = (
+            http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+        )
+        self.host = parts.hostname
+        self.port = parts.port
+        self.prefix = parts.path.rstrip("/")
+        self.timeout = timeout
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def _connect(self):
+        return self.conn_class(self.host, self.port, timeout=self.timeout)
+
+    def get(self, path_qs):
+        """GET ``path_qs`` (relative to the API base); return (status, body)."""
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        for attempt in range(2):
+            try:
+                conn.request("GET", self.prefix + path_qs, headers={"Accept": "application/json"})
+                resp = conn.getresponse()
+                body = resp.read()
+                break
+            except (http.client.HTTPException, OSError):
+                conn.close()
+                if attempt:
+                    raise
+                conn = self._connect()  # stale keep-alive connection
+        if resp.will_close:
+            conn.close()
+        else:
+            try:
+                self._idle.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+        return resp.status, body
+
+
+class DaemonHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        server = self.server
+        if self.path == "/health":
+            self._reply(200, b'{"status": "ok"}')
+            return
+
+        body = server.cache.get(self.path)
+        if body is not None:
+            self._reply(200, body)
+            return
+
+        server.rate_limiter.wait()
+        try:
+            status, body = server.pool.get(self.path)
+        except (http.client.HTTPException, OSError) as e:
+            self._reply(502, json.dumps({"error": str(e)}).encode())
+            return
+        if status == 200:
+            server.cache.put(self.path, body)
+        self._reply(status, body)
+
+    def _reply(self, status, body):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        if self.server.verbose:
+            super().log_message(fmt, *args)
+
+
+def cmd_serve(args):
+    """Run the local daemon that CLI invocations forward their requests to."""
+    server = http.server.ThreadingHTTPServer((DAEMON_HOST, args.port), DaemonHandler)
+    server.daemon_threads = True
+    server.rate_limiter = RateLimiter(args.interval)
+    server.cache = ResponseCache(args.cache_ttl)
+    server.pool = UpstreamPool(size=args.pool_size)
+    server.verbose = args.verbose
+
+    print(f"Serving ClinicalTrials.gov proxy on http://{DAEMON_HOST}:{args.port}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def add_filter_arguments(parser):
+    parser.add_argument("-c", "--condition", help="Disease or condition")
+    parser.add_argument("-i", "--intervention", help="Treatment or intervention")
+    parser.add_argument("-t", "--term", help="Full-text search term")
+    parser.add_argument("-s", "--sponsor", help="Sponsor or collaborator")
+    parser.add_argument("-l", "--location", help="Geographic location")
+    parser.add_argument(
+        "--status",
+        help=f"Comma-separated statuses: {', '.join(VALID_STATUSES)}",
+    )
+    parser.add_argument(
+        "--phase",
+        help=f"Comma-separated phases: {', '.join(VALID_PHASES)}",
+    )
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="Query the ClinicalTrials.gov API v2",
@@ -340,25 +722,16 @@ def main():
   %(prog)s search --term "diabetes" --location "New York" --page-size 5
   %(prog)s search --sponsor "Pfizer" --sort "EnrollmentCount:desc"
   %(prog)s study NCT04267848
-  %(prog)s study NCT04267848 --json""",
+  %(prog)s study NCT04267848 --json
+  %(prog)s study NCT04267848 --archive raw_archive
+  %(prog)s counts --condition "cancer OR oncology" --by year,phase
+  %(prog)s serve --port 8765""",
     )
     subparsers = parser.add_subparsers(dest="command", required=True)
 
     # search subcommand
     search_parser = subparsers.add_parser("search", help="Search for clinical trials")
-    search_parser.add_argument("-c", "--condition", help="Disease or condition")
-    search_parser.add_argument("-i", "--intervention", help="Treatment or intervention")
-    search_parser.add_argument("-t", "--term", help="Full-text search term")
-    search_parser.add_argument("-s", "--sponsor", help="Sponsor or collaborator")
-    search_parser.add_argument("-l", "--location", help="Geographic location")
-    search_parser.add_argument(
-        "--status",
-        help=f"Comma-separated statuses: {', '.join(VALID_STATUSES)}",
-    )
-    search_parser.add_argument(
-        "--phase",
-        help=f"Comma-separated phases: {', '.join(VALID_PHASES)}",
-    )
+    add_filter_arguments(search_parser)
     search_parser.add_argument(
         "--sort",
         help="Sort field:direction (e.g. EnrollmentCount:desc)",
@@ -375,6 +748,47 @@ def main():
     study_parser = subparsers.add_parser("study", help="Get details for a specific study")
     study_parser.add_argument("nct_id", help="NCT ID of the study (e.g. NCT04267848)")
     study_parser.add_argument("--json", action="store_true", help="Output raw JSON")
+    study_parser.add_argument(
+        "--archive",
+        metavar="DIR",
+        default=os.environ.get("CTGOV_ARCHIVE"),
+        help="Serve from a local raw-study archive when it has the study (default: $CTGOV_ARCHIVE)",
+    )
+
+    # counts subcommand
+    counts_parser = subparsers.add_parser(
+        "counts", help="Count trials per year/phase/status server-side, without downloading them"
+    )
+    add_filter_arguments(counts_parser)
+    counts_parser.add_argument(
+        "--by", default="year",
+        help=f"Comma-separated dimensions: {', '.join(PUSHDOWN_DIMENSIONS)} (default: year)",
+    )
+    counts_parser.add_argument(
+        "--years", type=parse_year_range, default="2022-2025",
+        help="Start-year range every count is limited to (default: 2022-2025)",
+    )
+    counts_parser.add_argument("--workers", type=int, default=4, help="Concurrent requests (default: 4)")
+    counts_parser.add_argument("--json", action="store_true", help="Output counts as JSON")
+
+    # serve subcommand
+    serve_parser = subparsers.add_parser(
+        "serve", help="Run a local daemon that pools connections, caches and rate-limits"
+    )
+    serve_parser.add_argument(
+        "--port", type=int, default=DAEMON_PORT, help=f"Port to listen on (default: {DAEMON_PORT})"
+    )
+    serve_parser.add_argument(
+        "--cache-ttl", type=int, default=3600, help="Seconds to cache responses (default: 3600, 0 disables)"
+    )
+    serve_parser.add_argument(
+        "--interval", type=float, default=REQUEST_INTERVAL,
+        help=f"Minimum seconds between upstream requests (default: {REQUEST_INTERVAL})",
+    )
+    serve_parser.add_argument(
+        "--pool-size", type=int, default=4, help="Idle upstream connections to keep (default: 4)"
+    )
+    serve_parser.add_argument("-v", "--verbose", action="store_true", help="Log each request")
 
     args = parser.parse_args()
 
@@ -382,6 +796,10 @@ def main():
         cmd_search(args)
     elif args.command == "study":
         cmd_study(args)
+    elif args.command == "counts":
+        cmd_counts(args)
+    elif args.command == "serve":
+        cmd_serve(args)
 
 
 if __name__ == "__main__":
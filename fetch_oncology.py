@@ -1,15 +1,28 @@
 #!/usr/bin/env python3
 """Fetch all oncology/cancer trials from 2022-2025 and export to CSV."""
 
+import argparse
 import csv
+import hashlib
 import json
+import os
 import sys
 import time
 import urllib.parse
 import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from archive import ArchiveWriter, compact_archive, study_nct_id
+from ctgov import RateLimiter
+from nct_index import build_index
+from partitions import PartitionedSink
 
 BASE_URL = "https://clinicaltrials.gov/api/v2"
 OUTPUT_FILE = "oncology_trials_2022_2025.csv"
+MEMBERSHIP_FILE = "cohort_membership.csv"
+
+ID_PAGE_SIZE = 1000
+ID_BATCH_SIZE = 200  # nct_ids per filter.ids request when fetching full records
 
 CSV_COLUMNS = [
     "nct_id",
@@ -40,8 +53,33 @@ CSV_COLUMNS = [
     "num_locations",
     "has_us_site",
     "study_url",
+    "has_results",
 ]
 
+# Normalized export: one narrow file per multi-valued field, keyed by nct_id,
+# instead of the "|"-joined columns of CSV_COLUMNS.
+MULTI_VALUE_COLUMNS = {
+    "collaborators",
+    "conditions",
+    "keywords",
+    "interventions",
+    "primary_outcomes",
+    "secondary_outcomes",
+    "countries",
+    "facilities",
+}
+TRIAL_COLUMNS = [c for c in CSV_COLUMNS if c not in MULTI_VALUE_COLUMNS]
+
+NORMALIZED_TABLES = {
+    "trials": TRIAL_COLUMNS,
+    "trial_locations": ["nct_id", "facility", "city", "state", "country", "status"],
+    "trial_interventions": ["nct_id", "type", "name"],
+    "trial_conditions": ["nct_id", "condition"],
+    "trial_keywords": ["nct_id", "keyword"],
+    "trial_collaborators": ["nct_id", "name", "class"],
+    "trial_outcomes": ["nct_id", "outcome_type", "measure", "time_frame"],
+}
+
 
 def api_request(endpoint, params):
     url = f"{BASE_URL}{endpoint}?" + urllib.parse.urlencode(params)
@@ -110,10 +148,271 @@ def extract_row(study):
         "num_locations": len(locations),
         "has_us_site": has_us,
         "study_url": f"https://clinicaltrials.gov/study/{nct_id}" if nct_id else "",
+        "has_results": bool(study.get("hasResults")),
     }
 
 
-def main():
+def extract_tables(study):
+    """Split a study into rows for each of NORMALIZED_TABLES."""
+    proto = study.get("protocolSection", {})
+    conditions = proto.get("conditionsModule", {})
+    sponsors = proto.get("sponsorCollaboratorsModule", {})
+    arms = proto.get("armsInterventionsModule", {})
+    outcomes = proto.get("outcomesModule", {})
+    contacts = proto.get("contactsLocationsModule", {})
+
+    row = extract_row(study)
+    nct_id = row["nct_id"]
+
+    return {
+        "trials": [{c: row[c] for c in TRIAL_COLUMNS}],
+        "trial_locations": [
+            {
+                "nct_id": nct_id,
+                "facility": loc.get("facility", ""),
+                "city": loc.get("city", ""),
+                "state": loc.get("state", ""),
+                "country": loc.get("country", ""),
+                "status": loc.get("status", ""),
+            }
+            for loc in contacts.get("locations", [])
+        ],
+        "trial_interventions": [
+            {"nct_id": nct_id, "type": i.get("type", ""), "name": i.get("name", "")}
+            for i in arms.get("interventions", [])
+        ],
+        "trial_conditions": [
+            {"nct_id": nct_id, "condition": c} for c in conditions.get("conditions", [])
+        ],
+        "trial_keywords": [
+            {"nct_id": nct_id, "keyword": k} for k in conditions.get("keywords", [])
+        ],
+        "trial_collaborators": [
+            {"nct_id": nct_id, "name": c.get("name", ""), "class": c.get("class", "")}
+            for c in sponsors.get("collaborators", [])
+        ],
+        "trial_outcomes": [
+            {
+                "nct_id": nct_id,
+                "outcome_type": kind,
+                "measure": o.get("measure", ""),
+                "time_frame": o.get("timeFrame", ""),
+            }
+            for kind, key in (("primary", "primaryOutcomes"), ("secondary", "secondaryOutcomes"))
+            for o in outcomes.get(key, [])
+        ],
+    }
+
+
+# ---------------------------------------------------------------------------
+# Output sinks
+#
+# Every export writes rows through a sink with writerow()/close().  Both
+# sinks keep a per-output state file of content hashes keyed by nct_id so a
+# later --delta run can tell inserted, changed and deleted trials apart.
+# ---------------------------------------------------------------------------
+def row_hash(row, fieldnames=CSV_COLUMNS):
+    """Stable content hash of an extracted row."""
+    payload = json.dumps([str(row.get(c, "")) for c in fieldnames], ensure_ascii=False)
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+def state_path(output):
+    return output + ".state.json"
+
+
+def load_state(output):
+    try:
+        with open(state_path(output), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"hashes": {}, "pending": []}
+
+
+def save_state(output, state):
+    tmp = state_path(output) + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp, state_path(output))
+
+
+class CsvSink:
+    """Write a full snapshot CSV, reset the hash state and rebuild its nct_id index.
+
+    Rows go to <output>.tmp, which only replaces the snapshot on close();
+    abort() discards it and leaves the previous snapshot and state alone.
+    """
+
+    def __init__(self, output, fieldnames=CSV_COLUMNS):
+        self.output = output
+        self.fieldnames = fieldnames
+        self.hashes = {}
+        self._file = open(output + ".tmp", "w", newline="", encoding="utf-8")
+        self._writer = csv.DictWriter(self._file, fieldnames=fieldnames)
+        self._writer.writeheader()
+
+    def writerow(self, row):
+        self._writer.writerow(row)
+        self.hashes[row["nct_id"]] = row_hash(row, self.fieldnames)
+
+    def close(self, complete=True):
+        self._file.close()
+        os.replace(self.output + ".tmp", self.output)
+        save_state(self.output, {"hashes": self.hashes, "pending": []})
+        build_index(self.output)
+
+    def abort(self):
+        self._file.close()
+        os.remove(self.output + ".tmp")
+
+
+class DeltaSink:
+    """Write only inserted, changed and deleted rows as a change-set CSV.
+
+    The snapshot itself is left alone; change-sets are queued in the state
+    file until compact_snapshot() folds them in.  Deletions are only emitted
+    when ``complete`` is true, i.e. the whole cohort was listed.
+    """
+
+    def __init__(self, output, fieldnames=CSV_COLUMNS):
+        self.output = output
+        self.fieldnames = fieldnames
+        self.state = load_state(output)
+        self.seen = set()
+        self.counts = {"insert": 0, "update": 0, "delete": 0}
+        stem = output[:-4] if output.endswith(".csv") else output
+        self.changes = f"{stem}.changes.{time.strftime('%Y%m%dT%H%M%S')}.csv"
+        n = 1
+        while os.path.exists(self.changes) or self.changes in self.state["pending"]:
+            n += 1
+            self.changes = f"{stem}.changes.{time.strftime('%Y%m%dT%H%M%S')}-{n}.csv"
+        self._file = None
+        self._writer = None
+
+    def _emit(self, change):
+        if self._writer is None:
+            self._file = open(self.changes, "w", newline="", encoding="utf-8")
+            self._writer = csv.DictWriter(self._file, fieldnames=["op"] + self.fieldnames)
+            self._writer.writeheader()
+        self._writer.writerow(change)
+        self.counts[change["op"]] += 1
+
+    def writerow(self, row):
+        nct_id = row["nct_id"]
+        self.seen.add(nct_id)
+        h = row_hash(row, self.fieldnames)
+        old = self.state["hashes"].get(nct_id)
+        if old == h:
+            return
+        self._emit({"op": "insert" if old is None else "update", **row})
+        self.state["hashes"][nct_id] = h
+
+    def close(self, complete=True):
+        hashes = self.state["hashes"]
+        if complete:
+            for nct_id in [n for n in hashes if n not in self.seen]:
+                self._emit({"op": "delete", "nct_id": nct_id})
+                del hashes[nct_id]
+        else:
+            print(f"  {self.output}: incomplete fetch, not emitting deletions", file=sys.stderr)
+
+        if self._file is not None:
+            self._file.close()
+            self.state["pending"].append(self.changes)
+            print(
+                f"  Change-set {self.changes}: {self.counts['insert']} inserted, "
+                f"{self.counts['update']} changed, {self.counts['delete']} deleted"
+            )
+        else:
+            print(f"  {self.output}: no changes")
+        save_state(self.output, self.state)
+
+    def abort(self):
+        if self._file is not None:
+            self._file.close()
+            os.remove(self.changes)
+
+
+class NormalizedSink:
+    """Write extract_tables() output as one CSV per table in a directory.
+
+    The directory is the output path without its .csv suffix.
+    """
+
+    def __init__(self, output):
+        self.output = output[:-4] if output.endswith(".csv") else output
+        os.makedirs(self.output, exist_ok=True)
+        self._files = {}
+        self._writers = {}
+        for table, columns in NORMALIZED_TABLES.items():
+            f = open(os.path.join(self.output, f"{table}.csv.tmp"), "w", newline="", encoding="utf-8")
+            self._files[table] = f
+            self._writers[table] = csv.DictWriter(f, fieldnames=columns)
+            self._writers[table].writeheader()
+
+    def writerow(self, tables):
+        for table, rows in tables.items():
+            self._writers[table].writerows(rows)
+
+    def close(self, complete=True):
+        for table, f in self._files.items():
+            f.close()
+            path = os.path.join(self.output, f"{table}.csv")
+            os.replace(path + ".tmp", path)
+
+    def abort(self):
+        for table, f in self._files.items():
+            f.close()
+            os.remove(os.path.join(self.output, f"{table}.csv.tmp"))
+
+
+def open_sink(output, delta=False, fieldnames=CSV_COLUMNS, normalized=False, partition_by=None):
+    if normalized:
+        return NormalizedSink(output)
+    if partition_by:
+        return PartitionedSink(output, fieldnames, partition_by)
+    return DeltaSink(output, fieldnames) if delta else CsvSink(output, fieldnames)
+
+
+def compact_snapshot(output):
+    """Fold pending change-sets into the snapshot CSV for ``output``."""
+    state = load_state(output)
+    if not state["pending"]:
+        print(f"{output}: nothing to compact")
+        return
+
+    rows = {}
+    fieldnames = CSV_COLUMNS
+    if os.path.exists(output):
+        with open(output, "r", newline="", encoding="utf-8") as f:
+            reader = csv.DictReader(f)
+            for row in reader:
+                rows[row["nct_id"]] = row
+            fieldnames = reader.fieldnames or fieldnames
+    for changes in state["pending"]:
+        with open(changes, "r", newline="", encoding="utf-8") as f:
+            reader = csv.DictReader(f)
+            fieldnames = reader.fieldnames[1:]
+            for change in reader:
+                op = change.pop("op")
+                if op == "delete":
+                    rows.pop(change["nct_id"], None)
+                else:
+                    rows[change["nct_id"]] = change
+
+    tmp = output + ".tmp"
+    with open(tmp, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(rows.values())
+    os.replace(tmp, output)
+    build_index(output)
+    print(f"{output}: compacted {len(state['pending'])} change-sets into {len(rows)} trials")
+    state["pending"] = []
+    save_state(output, state)
+
+
+def export_default(delta=False, archive=None, normalized=False, partition_by=None):
     params = {
         "format": "json",
         "pageSize": 1000,
@@ -127,23 +426,26 @@ def main():
     total = data.get("totalCount", 0)
     print(f"Total trials to fetch: {total}")
 
-    with open(OUTPUT_FILE, "w", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(f, fieldnames=CSV_COLUMNS)
-        writer.writeheader()
-
+    extract = extract_tables if normalized else extract_row
+    sink = open_sink(OUTPUT_FILE, delta, normalized=normalized, partition_by=partition_by)
+    complete = False
+    try:
         page = 1
         fetched = 0
 
         while True:
             studies = data.get("studies", [])
             for study in studies:
-                writer.writerow(extract_row(study))
+                sink.writerow(extract(study))
+                if archive is not None:
+                    archive.add(study)
                 fetched += 1
 
             print(f"  Page {page}: wrote {len(studies)} studies ({fetched}/{total})")
 
             page_token = data.get("nextPageToken")
             if not page_token:
+                complete = True
                 break
 
             page += 1
@@ -164,8 +466,244 @@ def main():
                 except Exception as e2:
                     print(f"  Failed again: {e2}. Stopping.", file=sys.stderr)
                     break
+    finally:
+        sink.close(complete)
+
+    print(f"\nDone. {fetched} trials processed for {OUTPUT_FILE}")
+
+
+def fetch_with_retry(endpoint, params, limiter, label, request=None):
+    """api_request under the shared limiter, retrying once after 10 seconds.
+
+    ``request(endpoint, params)``, when given, replaces the limiter-paced
+    direct call, e.g. to go through the ctgov.py daemon.
+    """
+
+    def attempt():
+        if request is not None:
+            return request(endpoint, params)
+        limiter.wait()
+        return api_request(endpoint, params)
+
+    try:
+        return attempt()
+    except Exception as e:
+        print(f"  Error on {label}: {e}", file=sys.stderr)
+        print("  Retrying in 10 seconds...", file=sys.stderr)
+        time.sleep(10)
+    try:
+        return attempt()
+    except Exception as e2:
+        print(f"  Failed again on {label}: {e2}.", file=sys.stderr)
+        return None
+
+
+def load_cohorts(path):
+    """Read a cohort config file.
+
+    The file is JSON of the form::
+
+        {
+          "defaults": {"filter.advanced": "AREA[StartDate]RANGE[2022-01-01, 2025-12-31]"},
+          "membership_file": "cohort_membership.csv",
+          "cohorts": [
+            {"name": "oncology", "params": {"query.cond": "cancer OR oncology"},
+             "output": "oncology_trials.csv"}
+          ]
+        }
+
+    ``defaults`` are merged under each cohort's ``params``.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        config = json.load(f)
+
+    defaults = config.get("defaults", {})
+    cohorts = []
+    seen = set()
+    for entry in config.get("cohorts", []):
+        name = entry.get("name")
+        if not name or not entry.get("output"):
+            sys.exit(f"{path}: every cohort needs a name and an output")
+        if name in seen:
+            sys.exit(f"{path}: duplicate cohort name {name!r}")
+        seen.add(name)
+        cohorts.append({
+            "name": name,
+            "params": {**defaults, **entry.get("params", {})},
+            "output": entry["output"],
+        })
+    if not cohorts:
+        sys.exit(f"{path}: no cohorts defined")
+    config["cohorts"] = cohorts
+    config.setdefault("membership_file", MEMBERSHIP_FILE)
+    return config
+
+
+def list_cohort_ids(cohort, limiter):
+    """Page through a cohort's query fetching only nct_ids.
+
+    Returns (ids, complete) where complete is false if listing stopped early.
+    """
+    params = {
+        "format": "json",
+        "pageSize": ID_PAGE_SIZE,
+        "countTotal": "true",
+        "fields": "NCTId",
+        **cohort["params"],
+    }
+    ids = []
+    page = 1
+    while True:
+        data = fetch_with_retry("/studies", params, limiter, f"{cohort['name']} id page {page}")
+        if data is None:
+            print(f"  [{cohort['name']}] stopping listing at page {page}", file=sys.stderr)
+            return ids, False
+        if page == 1:
+            print(f"  [{cohort['name']}] {data.get('totalCount', 0)} trials")
+        for study in data.get("studies", []):
+            nct_id = study.get("protocolSection", {}).get("identificationModule", {}).get("nctId")
+            if nct_id:
+                ids.append(nct_id)
+        page_token = data.get("nextPageToken")
+        if not page_token:
+            break
+        page += 1
+        params["pageToken"] = page_token
+        params.pop("countTotal", None)
+    return ids, True
+
+
+def fetch_rows_by_id(nct_ids, limiter, workers, archive=None, extract=extract_row):
+    """Fetch and extract each nct_id exactly once, in filter.ids batches."""
+    batches = [nct_ids[i:i + ID_BATCH_SIZE] for i in range(0, len(nct_ids), ID_BATCH_SIZE)]
+
+    def fetch_batch(numbered):
+        n, batch = numbered
+        params = {
+            "format": "json",
+            "pageSize": len(batch),
+            "filter.ids": ",".join(batch),
+        }
+        data = fetch_with_retry("/studies", params, limiter, f"batch {n}/{len(batches)}")
+        if data is None:
+            return []
+        return data.get("studies", [])
+
+    rows = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for n, studies in enumerate(pool.map(fetch_batch, enumerate(batches, 1)), 1):
+            for study in studies:
+                rows[study_nct_id(study)] = extract(study)
+                if archive is not None:
+                    archive.add(study)
+            print(f"  Batch {n}/{len(batches)}: extracted {len(studies)} studies ({len(rows)}/{len(nct_ids)})")
+    return rows
+
+
+def export_cohorts(config, workers=4, delta=False, archive=None, normalized=False, partition_by=None):
+    """Export every cohort in ``config`` with one shared fetch per study."""
+    limiter = RateLimiter()
+    cohorts = config["cohorts"]
+
+    print(f"Listing {len(cohorts)} cohorts...")
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        listings = list(pool.map(lambda c: list_cohort_ids(c, limiter), cohorts))
+    cohort_ids = [ids for ids, _ in listings]
+
+    membership = {}
+    for cohort, ids in zip(cohorts, cohort_ids):
+        for nct_id in ids:
+            membership.setdefault(nct_id, []).append(cohort["name"])
+    listed = sum(len(ids) for ids in cohort_ids)
+    print(f"{len(membership)} unique trials across cohorts ({listed - len(membership)} overlapping)")
+
+    extract = extract_tables if normalized else extract_row
+    rows = fetch_rows_by_id(list(membership), limiter, workers, archive, extract)
+
+    for cohort, (ids, listed_all) in zip(cohorts, listings):
+        sink = open_sink(cohort["output"], delta, normalized=normalized, partition_by=partition_by)
+        written = 0
+        for nct_id in ids:
+            if nct_id in rows:
+                sink.writerow(rows[nct_id])
+                written += 1
+        sink.close(listed_all and written == len(ids))
+        print(f"  [{cohort['name']}] {written} trials processed for {cohort['output']}")
+
+    with open(config["membership_file"], "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["nct_id", "cohort"])
+        for nct_id, names in membership.items():
+            for name in names:
+                writer.writerow([nct_id, name])
+    print(f"\nDone. Cohort membership written to {config['membership_file']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--config", help="JSON file declaring several cohorts to export in one shared crawl"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=4, help="Concurrent requests for --config runs (default: 4)"
+    )
+    parser.add_argument(
+        "--delta", action="store_true",
+        help="Write only inserted/changed/deleted rows to a change-set CSV instead of a full snapshot",
+    )
+    parser.add_argument(
+        "--compact", action="store_true",
+        help="Fold pending change-sets into the snapshot CSV(s) (and, with --archive, drop superseded "
+        "archived studies) and exit without fetching",
+    )
+    parser.add_argument(
+        "--archive", metavar="DIR", help="Also append raw study JSON to a compressed archive in DIR"
+    )
+    parser.add_argument(
+        "--archive-codec", choices=["gzip", "zstd"], default="gzip",
+        help="Compression for a new archive (default: gzip; zstd needs the zstandard package)",
+    )
+    parser.add_argument(
+        "--normalized", action="store_true",
+        help="Write trials plus child tables (locations, interventions, ...) into a directory named after the output",
+    )
+    parser.add_argument(
+        "--partition-by", choices=["year", "year,phase"],
+        help="Write one CSV per start year (or year and phase) plus a manifest into a directory named after "
+        "the output; a refresh only rewrites partitions whose rows changed",
+    )
+    args = parser.parse_args()
+    if args.normalized and (args.delta or args.compact):
+        parser.error("--normalized cannot be combined with --delta or --compact")
+    if args.partition_by and (args.delta or args.compact or args.normalized):
+        parser.error("--partition-by cannot be combined with --delta, --compact or --normalized")
+    partition_by = args.partition_by.split(",") if args.partition_by else None
+
+    config = load_cohorts(args.config) if args.config else None
+    if args.compact:
+        outputs = [c["output"] for c in config["cohorts"]] if config else [OUTPUT_FILE]
+        for output in outputs:
+            compact_snapshot(output)
+        if args.archive:
+            live, dropped = compact_archive(args.archive)
+            print(f"{args.archive}: kept {live} studies, dropped {dropped} superseded versions")
+        return
 
-    print(f"\nDone. {fetched} trials written to {OUTPUT_FILE}")
+    archive = ArchiveWriter(args.archive, codec=args.archive_codec) if args.archive else None
+    try:
+        if config:
+            export_cohorts(
+                config, workers=args.workers, delta=args.delta, archive=archive, normalized=args.normalized,
+                partition_by=partition_by,
+            )
+        else:
+            export_default(
+                delta=args.delta, archive=archive, normalized=args.normalized, partition_by=partition_by
+            )
+    finally:
+        if archive is not None:
+            archive.close()
+            print(f"Archived {archive.written} raw studies to {args.archive} ({archive.skipped} unchanged)")
 
 
 if __name__ == "__main__":
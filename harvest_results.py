@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""Harvest posted results for trials in an exported CSV.
+
+Only studies flagged has_results in the export are fetched, in batched
+requests projected down to the results section, and their adverse events
+and outcome measures are written to dedicated tables.  Requests go through
+the ctgov.py daemon when it is running, sharing its rate budget.  A re-run
+skips studies whose last update date has not moved since they were
+harvested.
+"""
+
+import argparse
+import csv
+import hashlib
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from archive import study_nct_id
+from ctgov import RateLimiter, request_json
+from fetch_oncology import OUTPUT_FILE, fetch_with_retry
+
+OUTPUT_DIR = "results"
+STATE_FILE = "harvest_state.json"
+BATCH_SIZE = 20  # results sections are large; keep pages small
+RESULTS_FIELDS = "NCTId,LastUpdatePostDate,ResultsSection"
+
+ADVERSE_EVENT_COLUMNS = [
+    "nct_id",
+    "event_type",
+    "term",
+    "organ_system",
+    "assessment_type",
+    "group_id",
+    "group_title",
+    "num_events",
+    "num_affected",
+    "num_at_risk",
+]
+
+OUTCOME_MEASURE_COLUMNS = [
+    "nct_id",
+    "outcome_type",
+    "title",
+    "time_frame",
+    "param_type",
+    "dispersion_type",
+    "unit",
+    "class_title",
+    "category_title",
+    "group_id",
+    "group_title",
+    "value",
+    "spread",
+    "lower_limit",
+    "upper_limit",
+]
+
+TABLES = {
+    "adverse_events": ADVERSE_EVENT_COLUMNS,
+    "outcome_measures": OUTCOME_MEASURE_COLUMNS,
+}
+
+
+def adverse_event_rows(nct_id, module):
+    groups = {g.get("id"): g.get("title", "") for g in module.get("eventGroups", [])}
+    for event_type, key in (("serious", "seriousEvents"), ("other", "otherEvents")):
+        for event in module.get(key, []):
+            for stat in event.get("stats", []):
+                yield {
+                    "nct_id": nct_id,
+                    "event_type": event_type,
+                    "term": event.get("term", ""),
+                    "organ_system": event.get("organSystem", ""),
+                    "assessment_type": event.get("assessmentType", ""),
+                    "group_id": stat.get("groupId", ""),
+                    "group_title": groups.get(stat.get("groupId"), ""),
+                    "num_events": stat.get("numEvents", ""),
+                    "num_affected": stat.get("numAffected", ""),
+                    "num_at_risk": stat.get("numAtRisk", ""),
+                }
+
+
+def outcome_measure_rows(nct_id, module):
+    for measure in module.get("outcomeMeasures", []):
+        groups = {g.get("id"): g.get("title", "") for g in measure.get("groups", [])}
+        base = {
+            "nct_id": nct_id,
+            "outcome_type": measure.get("type", ""),
+            "title": measure.get("title", ""),
+            "time_frame": measure.get("timeFrame", ""),
+            "param_type": measure.get("paramType", ""),
+            "dispersion_type": measure.get("dispersionType", ""),
+            "unit": measure.get("unitOfMeasure", ""),
+        }
+        for cls in measure.get("classes", []):
+            for category in cls.get("categories", []):
+                for m in category.get("measurements", []):
+                    yield {
+                        **base,
+                        "class_title": cls.get("title", ""),
+                        "category_title": category.get("title", ""),
+                        "group_id": m.get("groupId", ""),
+                        "group_title": groups.get(m.get("groupId"), ""),
+                        "value": m.get("value", ""),
+                        "spread": m.get("spread", ""),
+                        "lower_limit": m.get("lowerLimit", ""),
+                        "upper_limit": m.get("upperLimit", ""),
+                    }
+
+
+def select_pending(input_file, state):
+    """Return {nct_id: last_update_post_date} for studies needing a (re)harvest."""
+    pending = {}
+    with open(input_file, "r", encoding="utf-8") as f:
+        reader = csv.DictReader(f)
+        if "has_results" not in (reader.fieldnames or []):
+            sys.exit(f"{input_file} has no has_results column; re-export it with fetch_oncology.py first")
+        for row in reader:
+            if row.get("has_results") != "True":
+                continue
+            seen = state.get(row["nct_id"])
+            if seen is None or seen["updated"] != row["last_update_post_date"]:
+                pending[row["nct_id"]] = row["last_update_post_date"]
+    return pending
+
+
+def harvest(input_file=OUTPUT_FILE, output_dir=OUTPUT_DIR, workers=4):
+    os.makedirs(output_dir, exist_ok=True)
+    state_file = os.path.join(output_dir, STATE_FILE)
+    try:
+        with open(state_file, "r", encoding="utf-8") as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        state = {}
+
+    pending = select_pending(input_file, state)
+    print(f"{len(pending)} studies with new or updated results ({len(state)} already harvested)")
+    if not pending:
+        return
+
+    ids = list(pending)
+    batches = [ids[i:i + BATCH_SIZE] for i in range(0, len(ids), BATCH_SIZE)]
+    limiter = RateLimiter()  # only paces direct requests; a running daemon owns the budget
+
+    def request(endpoint, params):
+        return request_json(endpoint, params, limiter)
+
+    def fetch_batch(numbered):
+        n, batch = numbered
+        params = {
+            "format": "json",
+            "pageSize": len(batch),
+            "filter.ids": ",".join(batch),
+            "fields": RESULTS_FIELDS,
+        }
+        data = fetch_with_retry("/studies", params, limiter, f"results batch {n}/{len(batches)}", request)
+        return [] if data is None else data.get("studies", [])
+
+    paths = {t: os.path.join(output_dir, f"{t}.csv") for t in TABLES}
+    files = {t: open(paths[t] + ".tmp", "w", newline="", encoding="utf-8") for t in TABLES}
+    writers = {t: csv.DictWriter(files[t], fieldnames=cols) for t, cols in TABLES.items()}
+    for w in writers.values():
+        w.writeheader()
+
+    harvested = set()
+    unchanged = 0
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for n, studies in enumerate(pool.map(fetch_batch, enumerate(batches, 1)), 1):
+                for study in studies:
+                    nct_id = study_nct_id(study)
+                    results = study.get("resultsSection", {})
+                    digest = hashlib.sha1(json.dumps(results, sort_keys=True).encode()).hexdigest()
+                    old = state.get(nct_id)
+                    state[nct_id] = {"updated": pending.get(nct_id, ""), "hash": digest}
+                    if old is not None and old["hash"] == digest:
+                        unchanged += 1  # keep the rows already on disk
+                        continue
+                    harvested.add(nct_id)
+                    writers["adverse_events"].writerows(
+                        adverse_event_rows(nct_id, results.get("adverseEventsModule", {}))
+                    )
+                    writers["outcome_measures"].writerows(
+                        outcome_measure_rows(nct_id, results.get("outcomeMeasuresModule", {}))
+                    )
+                print(f"  Batch {n}/{len(batches)}: {len(studies)} studies")
+    finally:
+        # Carry over rows of every study that was not re-harvested this run.
+        for table in TABLES:
+            if os.path.exists(paths[table]):
+                with open(paths[table], "r", newline="", encoding="utf-8") as f:
+                    writers[table].writerows(r for r in csv.DictReader(f) if r["nct_id"] not in harvested)
+            files[table].close()
+            os.replace(paths[table] + ".tmp", paths[table])
+        with open(state_file + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(state_file + ".tmp", state_file)
+
+    print(f"\nDone. {len(harvested)} studies harvested, {unchanged} unchanged, into {output_dir}/")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--input", default=OUTPUT_FILE, help=f"Exported trials CSV (default: {OUTPUT_FILE})")
+    parser.add_argument("--output-dir", default=OUTPUT_DIR, help=f"Directory for results tables (default: {OUTPUT_DIR})")
+    parser.add_argument("--workers", type=int, default=4, help="Concurrent requests (default: 4)")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.input):
+        sys.exit(f"{args.input} not found; run fetch_oncology.py first")
+    harvest(args.input, args.output_dir, args.workers)
+
+
+if __name__ == "__main__":
+    main()
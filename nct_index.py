@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""Sidecar nct_id -> byte offset index for random access into exported CSVs.
+
+The index lives next to the CSV as <file>.idx: a small header, then the
+numeric part of every nct_id as a sorted uint32 array followed by the
+matching uint64 row offsets.  Both the index and the CSV are memory-mapped,
+so a lookup is a binary search plus one seek.
+"""
+
+import argparse
+import bisect
+import csv
+import io
+import json
+import mmap
+import os
+import re
+import struct
+import sys
+from array import array
+
+MAGIC = b"NCTIDX1\0"
+HEADER = struct.Struct("=8sQQQ")  # magic, count, source size, source mtime_ns
+NCT_RE = re.compile(rb'^"?NCT(\d{8})"?,')
+
+
+def index_path(csv_path):
+    return csv_path + ".idx"
+
+
+def _records(mm, start):
+    """Yield (offset, end) of each CSV record from ``start``, honouring quoted newlines."""
+    pos = start
+    size = len(mm)
+    while pos < size:
+        end = pos
+        quotes = 0
+        while True:
+            nl = mm.find(b"\n", end)
+            if nl == -1:
+                nl = size - 1
+            quotes += mm[end:nl + 1].count(b'"')
+            end = nl + 1
+            if quotes % 2 == 0 or end >= size:
+                break
+        yield pos, end
+        pos = end
+
+
+def build_index(csv_path):
+    """Scan csv_path and write its sidecar index; return the number of rows indexed."""
+    st = os.stat(csv_path)
+    latest = {}
+    with open(csv_path, "rb") as f:
+        if st.st_size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                header_end = next(_records(mm, 0))[1]
+                for offset, end in _records(mm, header_end):
+                    m = NCT_RE.match(mm[offset:offset + 16])
+                    if m:
+                        latest[int(m.group(1))] = offset  # a later duplicate wins
+
+    ids = array("I", sorted(latest))
+    offsets = array("Q", (latest[i] for i in ids))
+    tmp = index_path(csv_path) + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(ids), st.st_size, st.st_mtime_ns))
+        ids.tofile(f)
+        if f.tell() % 8:
+            f.write(b"\0" * (8 - f.tell() % 8))
+        offsets.tofile(f)
+    os.replace(tmp, index_path(csv_path))
+    return len(ids)
+
+
+class NctIndex:
+    """Memory-mapped lookups of rows in an indexed CSV export."""
+
+    def __init__(self, csv_path, rebuild_stale=True):
+        st = os.stat(csv_path)
+        if not self._is_current(csv_path, st):
+            if not rebuild_stale:
+                raise ValueError(f"{index_path(csv_path)} is missing or out of date")
+            build_index(csv_path)
+
+        self._idx_file = open(index_path(csv_path), "rb")
+        self._idx = mmap.mmap(self._idx_file.fileno(), 0, access=mmap.ACCESS_READ)
+        count = HEADER.unpack_from(self._idx)[1]
+        ids_start = HEADER.size
+        offsets_start = ids_start + count * 4
+        offsets_start += -offsets_start % 8
+        self._ids = memoryview(self._idx)[ids_start:ids_start + count * 4].cast("I")
+        self._offsets = memoryview(self._idx)[offsets_start:offsets_start + count * 8].cast("Q")
+
+        self._csv_file = open(csv_path, "rb")
+        self._csv = mmap.mmap(self._csv_file.fileno(), 0, access=mmap.ACCESS_READ) if st.st_size else b""
+        header_end = next(_records(self._csv, 0), (0, 0))[1]
+        self.fieldnames = next(csv.reader([self._csv[:header_end].decode("utf-8")]), [])
+
+    @staticmethod
+    def _is_current(csv_path, st):
+        try:
+            with open(index_path(csv_path), "rb") as f:
+                magic, _, size, mtime_ns = HEADER.unpack(f.read(HEADER.size))
+        except (OSError, struct.error):
+            return False
+        return magic == MAGIC and size == st.st_size and mtime_ns == st.st_mtime_ns
+
+    def __len__(self):
+        return len(self._ids)
+
+    def offset(self, nct_id):
+        """Return the byte offset of nct_id's row, or None."""
+        m = re.fullmatch(r"NCT(\d{8})", nct_id.strip().upper())
+        if not m:
+            return None
+        key = int(m.group(1))
+        i = bisect.bisect_left(self._ids, key)
+        if i < len(self._ids) and self._ids[i] == key:
+            return self._offsets[i]
+        return None
+
+    def _read_row(self, offset):
+        _, end = next(_records(self._csv, offset))
+        text = self._csv[offset:end].decode("utf-8")
+        values = next(csv.reader(io.StringIO(text)))
+        return dict(zip(self.fieldnames, values))
+
+    def get(self, nct_id):
+        """Return the row for nct_id as a dict, or None."""
+        offset = self.offset(nct_id)
+        return None if offset is None else self._read_row(offset)
+
+    def get_many(self, nct_ids):
+        """Return {nct_id: row} for the ids present, reading rows in file order."""
+        found = {n: self.offset(n) for n in nct_ids}
+        ordered = sorted((o, n) for n, o in found.items() if o is not None)
+        return {n: self._read_row(o) for o, n in ordered}
+
+    def close(self):
+        self._ids.release()
+        self._offsets.release()
+        self._idx.close()
+        self._idx_file.close()
+        if isinstance(self._csv, mmap.mmap):
+            self._csv.close()
+        self._csv_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build", help="(Re)build the index for a CSV export")
+    build_parser.add_argument("csv_file")
+
+    lookup_parser = subparsers.add_parser("lookup", help="Print rows for one or more NCT IDs")
+    lookup_parser.add_argument("csv_file")
+    lookup_parser.add_argument("nct_ids", nargs="+", help="NCT IDs, or - to read them from stdin")
+    lookup_parser.add_argument("--json", action="store_true", help="Print rows as JSON lines instead of CSV")
+
+    args = parser.parse_args()
+
+    if args.command == "build":
+        count = build_index(args.csv_file)
+        print(f"Indexed {count} trials in {index_path(args.csv_file)}")
+        return
+
+    nct_ids = args.nct_ids
+    if nct_ids == ["-"]:
+        nct_ids = [line.strip() for line in sys.stdin if line.strip()]
+    with NctIndex(args.csv_file) as index:
+        rows = index.get_many(nct_ids)
+        missing = [n for n in nct_ids if n not in rows]
+        if args.json:
+            for row in rows.values():
+                print(json.dumps(row, ensure_ascii=False))
+        else:
+            writer = csv.DictWriter(sys.stdout, fieldnames=index.fieldnames)
+            writer.writeheader()
+            writer.writerows(rows.values())
+    for n in missing:
+        print(f"Not found: {n}", file=sys.stderr)
+    if missing:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
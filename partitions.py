@@ -0,0 +1,233 @@
+"""Partitioned dataset layout: one CSV per start year (or year/phase).
+
+A dataset is a directory with hive-style partition paths such as
+``start_year=2023/part.csv`` or ``start_year=2023/phase=PHASE2/part.csv``
+and a manifest.json recording each partition's values, row count, content
+hash and min/max stats.  Readers use the manifest to skip partitions that
+cannot match a filter; writers only replace partitions whose content hash
+changed, so a refresh leaves untouched years alone.  An incomplete fetch
+is merged into the existing partitions rather than replacing them.
+"""
+
+import csv
+import hashlib
+import json
+import os
+import re
+import sys
+import urllib.parse
+
+MANIFEST_FILE = "manifest.json"
+PARTITION_KEYS = {"year": "start_year", "phase": "phase"}
+STAT_COLUMNS = ["start_date", "last_update_post_date", "enrollment"]
+
+
+def dataset_dir(output):
+    return output[:-4] if output.endswith(".csv") else output
+
+
+def is_partitioned(path):
+    return os.path.isfile(os.path.join(path, MANIFEST_FILE))
+
+
+def load_manifest(root):
+    with open(os.path.join(root, MANIFEST_FILE), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def partition_values(row, partition_by):
+    values = {}
+    for key in partition_by:
+        if key == "year":
+            m = re.match(r"(\d{4})", str(row.get("start_date", "")))
+            values[key] = m.group(1) if m else "unknown"
+        else:
+            values[key] = row.get("phase") or "none"
+    return values
+
+
+def partition_path(values):
+    parts = [f"{PARTITION_KEYS[k]}={urllib.parse.quote(v, safe='')}" for k, v in values.items()]
+    return "/".join(parts + ["part.csv"])
+
+
+def _update_stats(stats, row):
+    for column in STAT_COLUMNS:
+        value = row.get(column, "")
+        if value == "" or value is None:
+            continue
+        if column == "enrollment":
+            try:
+                value = int(value)
+            except ValueError:
+                continue
+        else:
+            value = str(value)
+        lo, hi = stats.get(column, (value, value))
+        stats[column] = [min(lo, value), max(hi, value)]
+
+
+class PartitionedSink:
+    """Write rows into a partitioned dataset directory named after the output."""
+
+    def __init__(self, output, fieldnames, partition_by=("year",)):
+        unknown = [k for k in partition_by if k not in PARTITION_KEYS]
+        if unknown:
+            raise ValueError(f"Cannot partition by {', '.join(unknown)} (choose from {', '.join(PARTITION_KEYS)})")
+        self.root = dataset_dir(output)
+        self.fieldnames = fieldnames
+        self.partition_by = list(partition_by)
+        os.makedirs(self.root, exist_ok=True)
+        try:
+            old = load_manifest(self.root)
+        except FileNotFoundError:
+            old = {}
+        if old.get("partition_by", self.partition_by) != self.partition_by:
+            old = {}  # layout changed; every partition is rewritten
+        self._old = {p["path"]: p for p in old.get("partitions", [])}
+        self._parts = {}
+        self._seen = set()
+
+    def _open(self, rel, values):
+        path = os.path.join(self.root, rel)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        f = open(path + ".tmp", "w", newline="", encoding="utf-8")
+        writer = csv.DictWriter(f, fieldnames=self.fieldnames)
+        writer.writeheader()
+        part = {"values": values, "file": f, "writer": writer, "rows": 0, "sha1": hashlib.sha1(), "stats": {}}
+        self._parts[rel] = part
+        return part
+
+    def writerow(self, row):
+        values = partition_values(row, self.partition_by)
+        rel = partition_path(values)
+        part = self._parts.get(rel) or self._open(rel, values)
+        part["writer"].writerow(row)
+        part["rows"] += 1
+        # Hash cells as csv writes them, so rows read back from disk hash the same.
+        cells = ["" if row.get(c) is None else str(row.get(c)) for c in self.fieldnames]
+        part["sha1"].update(json.dumps(cells).encode())
+        self._seen.add(row["nct_id"])
+        _update_stats(part["stats"], row)
+
+    def abort(self):
+        """Discard everything written so far; the dataset and manifest are untouched."""
+        for rel, part in self._parts.items():
+            part["file"].close()
+            os.remove(os.path.join(self.root, rel) + ".tmp")
+        self._parts = {}
+        self._prune_empty_dirs()
+
+    def _prune_empty_dirs(self):
+        for dirpath, dirnames, filenames in os.walk(self.root, topdown=False):
+            if dirpath != self.root and not os.listdir(dirpath):
+                os.rmdir(dirpath)
+
+    def _merge_partial(self):
+        """Fold this run's rows into the existing partitions.
+
+        Old rows are kept unless their trial was fetched again (possibly
+        into another partition); the fetched rows are then appended.
+        Afterwards the staged partitions describe the whole dataset.
+        """
+        staged = []
+        for rel in self._parts:
+            path = os.path.join(self.root, rel)
+            os.replace(path + ".tmp", path + ".new")
+            staged.append(path + ".new")
+        fetched = self._seen
+        self._parts = {}
+        self._seen = set()
+        for rel in self._old:
+            path = os.path.join(self.root, rel)
+            if not os.path.exists(path):
+                continue
+            with open(path, "r", newline="", encoding="utf-8") as f:
+                for row in csv.DictReader(f):
+                    if row["nct_id"] not in fetched:
+                        self.writerow(row)
+        for path in staged:
+            with open(path, "r", newline="", encoding="utf-8") as f:
+                for row in csv.DictReader(f):
+                    self.writerow(row)
+            os.remove(path)
+        for part in self._parts.values():
+            part["file"].close()
+
+    def close(self, complete=True):
+        for part in self._parts.values():
+            part["file"].close()
+        if not complete:
+            print(f"  {self.root}/: incomplete fetch, merging into existing partitions", file=sys.stderr)
+            self._merge_partial()
+
+        partitions = []
+        rewritten = unchanged = 0
+        for rel, part in sorted(self._parts.items()):
+            path = os.path.join(self.root, rel)
+            digest = part["sha1"].hexdigest()
+            old = self._old.pop(rel, None)
+            if old is not None and old["sha1"] == digest and os.path.exists(path):
+                os.remove(path + ".tmp")
+                unchanged += 1
+            else:
+                os.replace(path + ".tmp", path)
+                rewritten += 1
+            partitions.append({
+                "path": rel,
+                "values": part["values"],
+                "rows": part["rows"],
+                "sha1": digest,
+                "stats": part["stats"],
+            })
+
+        # Old partitions that received no rows: absent from a complete
+        # fetch, or emptied because all their trials moved during a merge.
+        removed = 0
+        for rel in self._old:
+            path = os.path.join(self.root, rel)
+            if os.path.exists(path):
+                os.remove(path)
+            removed += 1
+        # Drop partition directories left empty by removed partitions.
+        self._prune_empty_dirs()
+
+        manifest = {
+            "version": 1,
+            "partition_by": self.partition_by,
+            "columns": self.fieldnames,
+            "partitions": sorted(partitions, key=lambda p: p["path"]),
+        }
+        tmp = os.path.join(self.root, MANIFEST_FILE + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp, os.path.join(self.root, MANIFEST_FILE))
+        print(f"  {self.root}/: {rewritten} partitions rewritten, {unchanged} unchanged, {removed} removed")
+
+
+def _may_match(partition, years, phases):
+    values = partition["values"]
+    if years is not None:
+        if "year" in values:
+            if values["year"] == "unknown" or int(values["year"]) not in years:
+                return False
+        else:
+            lo, hi = partition["stats"].get("start_date", ("", ""))
+            if not lo or int(hi[:4]) < min(years) or int(lo[:4]) > max(years):
+                return False
+    if phases is not None and "phase" in values and values["phase"] not in phases:
+        return False
+    return True
+
+
+def select_partitions(root, years=None, phases=None):
+    """Return manifest entries for partitions that can contain matching rows.
+
+    ``years`` is a collection of start years and ``phases`` of phase labels;
+    None means no filter on that dimension.
+    """
+    return [p for p in load_manifest(root)["partitions"] if _may_match(p, years, phases)]
+
+
+def partition_files(root, years=None, phases=None):
+    return [os.path.join(root, p["path"]) for p in select_partitions(root, years, phases)]
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""Rebuild an export offline by re-running extraction over stored raw studies.
+
+Reads a raw-study archive (see archive.py) or NDJSON files of raw studies,
+runs extract_row -- or a user-supplied extractor -- across a process pool
+and writes the rows, in input order, through the exporter's sinks.
+"""
+
+import argparse
+import gzip
+import importlib
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from archive import ArchiveReader, load_frame
+from fetch_oncology import OUTPUT_FILE, open_sink
+
+CHUNK_STUDIES = 256  # studies per work unit for NDJSON input
+
+_extractors = {}
+
+
+def resolve_extractor(spec):
+    """Return the row function for ``spec`` ("module:function", "tables" or None)."""
+    if spec not in _extractors:
+        if spec is None:
+            from fetch_oncology import extract_row as fn
+        elif spec == "tables":
+            from fetch_oncology import extract_tables as fn
+        else:
+            module_name, _, attr = spec.partition(":")
+            if not attr:
+                raise ValueError(f"Extractor must look like module:function, got {spec!r}")
+            fn = getattr(importlib.import_module(module_name), attr)
+        _extractors[spec] = fn
+    return _extractors[spec]
+
+
+def _extract_frame(task):
+    extractor, path, codec, segment, offset, length, lines = task
+    fn = resolve_extractor(extractor)
+    return [fn(study) for study in load_frame(path, codec, segment, offset, length, lines)]
+
+
+def _extract_lines(task):
+    extractor, lines = task
+    fn = resolve_extractor(extractor)
+    return [fn(json.loads(line)) for line in lines]
+
+
+def archive_tasks(path, extractor):
+    with ArchiveReader(path) as reader:
+        total = len(reader)
+        tasks = [(extractor, path, reader.codec, *frame) for frame in reader.frames()]
+    return _extract_frame, tasks, total
+
+
+def ndjson_tasks(paths, extractor):
+    """Yield work units of CHUNK_STUDIES raw lines from NDJSON files."""
+    for path in paths:
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt", encoding="utf-8") as f:
+            chunk = []
+            for line in f:
+                if line.strip():
+                    chunk.append(line)
+                if len(chunk) >= CHUNK_STUDIES:
+                    yield extractor, chunk
+                    chunk = []
+            if chunk:
+                yield extractor, chunk
+
+
+def _ordered_results(pool, worker, tasks, window):
+    """Yield worker(task) results in task order, with at most ``window`` in flight.
+
+    Unlike pool.map(), tasks are pulled lazily, so a large NDJSON input is
+    never read into memory all at once.
+    """
+    pending = deque()
+    for task in tasks:
+        pending.append(pool.submit(worker, task))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def reextract(sources, output, extractor=None, workers=None, delta=False, normalized=False, partition_by=None):
+    """Re-extract ``sources`` into ``output``; return (studies, seconds)."""
+    if normalized:
+        extractor = "tables"
+    resolve_extractor(extractor)  # fail before starting workers or touching the output
+    missing = [path for path in sources if not os.path.exists(path)]
+    if missing:
+        raise FileNotFoundError(f"No such source: {', '.join(missing)}")
+    if len(sources) == 1 and os.path.isdir(sources[0]):
+        worker, tasks, total = archive_tasks(sources[0], extractor)
+    else:
+        worker, tasks, total = _extract_lines, ndjson_tasks(sources, extractor), None
+
+    # A custom extractor's columns are only known once it has produced a row.
+    if normalized:
+        sink = open_sink(output, normalized=True)
+    else:
+        sink = open_sink(output, delta, partition_by=partition_by) if extractor is None else None
+    done = 0
+    start = time.monotonic()
+    finished = False
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for rows in _ordered_results(pool, worker, tasks, 2 * (workers or os.cpu_count() or 1)):
+                if not rows:
+                    continue
+                if sink is None:
+                    sink = open_sink(output, delta, list(rows[0]), partition_by=partition_by)
+                for row in rows:
+                    sink.writerow(row)
+                done += len(rows)
+                if done % 10000 < len(rows):
+                    elapsed = time.monotonic() - start
+                    progress = f"{done}/{total}" if total else str(done)
+                    print(f"  {progress} studies ({done / elapsed:,.0f}/s)", file=sys.stderr)
+        finished = True
+    finally:
+        # A failed run must not replace the previous export with a partial one.
+        if sink is not None:
+            if finished:
+                sink.close()
+            else:
+                sink.abort()
+    return done, time.monotonic() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "sources", nargs="+",
+        help="An archive directory, or one or more NDJSON files (.ndjson or .ndjson.gz) of raw studies",
+    )
+    parser.add_argument("-o", "--output", default=OUTPUT_FILE, help=f"Output file (default: {OUTPUT_FILE})")
+    parser.add_argument(
+        "--extractor", metavar="MODULE:FUNCTION",
+        help="Row function to use instead of fetch_oncology.extract_row; its dict keys become the columns",
+    )
+    parser.add_argument("--workers", type=int, help="Worker processes (default: all cores)")
+    parser.add_argument(
+        "--delta", action="store_true", help="Write a change-set against the previous export instead of a snapshot"
+    )
+    parser.add_argument(
+        "--normalized", action="store_true",
+        help="Write trials plus child tables into a directory named after the output",
+    )
+    parser.add_argument(
+        "--partition-by", choices=["year", "year,phase"],
+        help="Write a dataset partitioned by start year (or year and phase) into a directory named after the output",
+    )
+    args = parser.parse_args()
+    if args.normalized and (args.delta or args.extractor):
+        parser.error("--normalized cannot be combined with --delta or --extractor")
+    if args.partition_by and (args.delta or args.normalized):
+        parser.error("--partition-by cannot be combined with --delta or --normalized")
+
+    # Let --extractor name a module in the working directory.
+    sys.path.insert(0, os.getcwd())
+    try:
+        studies, seconds = reextract(
+            args.sources, args.output, args.extractor, args.workers, args.delta, args.normalized,
+            args.partition_by.split(",") if args.partition_by else None,
+        )
+    except FileNotFoundError as e:
+        sys.exit(str(e))
+    rate = studies / seconds if seconds else 0
+    target = args.output
+    if (args.normalized or args.partition_by) and target.endswith(".csv"):
+        target = target[:-4] + "/"
+    print(f"Re-extracted {studies} studies into {target} in {seconds:.1f}s ({rate:,.0f} studies/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""Small streaming sketches used by analyze.py --approx.
+
+Each sketch reports an error bound alongside its estimate.
+"""
+
+import hashlib
+import heapq
+import math
+import random
+
+
+def _hash64(value):
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+class StratifiedReservoir:
+    """Uniform sample of up to ``size`` items per stratum (Algorithm R)."""
+
+    def __init__(self, size, seed=None):
+        self.size = size
+        self.seen = {}
+        self.samples = {}
+        self._random = random.Random(seed)
+
+    def add(self, stratum, item):
+        n = self.seen.get(stratum, 0) + 1
+        self.seen[stratum] = n
+        sample = self.samples.setdefault(stratum, [])
+        if len(sample) < self.size:
+            sample.append(item)
+        else:
+            j = self._random.randrange(n)
+            if j < self.size:
+                sample[j] = item
+
+
+def proportion(hits, n, population, z=1.96):
+    """Return (share, error) for ``hits`` of an ``n``-item sample of ``population``.
+
+    The error is the half-width of a normal-approximation confidence
+    interval (95% by default) with finite-population correction, so it is
+    zero when the whole population was sampled.
+    """
+    if not n:
+        return 0.0, 0.0
+    p = hits / n
+    fpc = math.sqrt((population - n) / (population - 1)) if population > 1 else 0.0
+    return p, z * math.sqrt(p * (1 - p) / n) * fpc
+
+
+class HyperLogLog:
+    """Distinct-count estimator with 2**precision registers."""
+
+    def __init__(self, precision=14):
+        self.p = precision
+        self.m = 1 << precision
+        self.registers = bytearray(self.m)
+        self.alpha = 0.7213 / (1 + 1.079 / self.m)
+
+    def add(self, value):
+        x = _hash64(value)
+        idx = x >> (64 - self.p)
+        rest = x & ((1 << (64 - self.p)) - 1)
+        rank = (64 - self.p) - rest.bit_length() + 1
+        if rank > self.registers[idx]:
+            self.registers[idx] = rank
+
+    def estimate(self):
+        est = self.alpha * self.m * self.m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if est <= 2.5 * self.m and zeros:
+            est = self.m * math.log(self.m / zeros)  # linear counting for small sets
+        return round(est)
+
+    def relative_error(self):
+        """Standard error of the estimate as a fraction (about 0.8% at precision 14)."""
+        return 1.04 / math.sqrt(self.m)
+
+
+class SpaceSaving:
+    """Heavy-hitter counts over a stream using at most ``capacity`` counters.
+
+    A reported count overestimates the true count by at most its error,
+    which never exceeds total / capacity.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.total = 0
+        self.counts = {}
+        self.errors = {}
+        self._heap = []  # (count, item); entries go stale as counts grow
+
+    def add(self, item):
+        self.total += 1
+        if item in self.counts:
+            self.counts[item] += 1
+        elif len(self.counts) < self.capacity:
+            self.counts[item] = 1
+            self.errors[item] = 0
+        else:
+            while True:
+                count, victim = heapq.heappop(self._heap)
+                if self.counts.get(victim) == count:
+                    break
+            del self.counts[victim]
+            del self.errors[victim]
+            self.counts[item] = count + 1
+            self.errors[item] = count
+        heapq.heappush(self._heap, (self.counts[item], item))
+        if len(self._heap) > 8 * self.capacity:
+            self._heap = [(c, i) for i, c in self.counts.items()]
+            heapq.heapify(self._heap)
+
+    def most_common(self, n):
+        """Return [(item, count, error)] for the n largest counters."""
+        top = sorted(self.counts.items(), key=lambda kv: -kv[1])[:n]
+        return [(item, count, self.errors[item]) for item, count in top]
+
+
+def ratio(numerators, denominators, population, z=1.96):
+    """Return (ratio, error) of sum(numerators) / sum(denominators) over a sample.
+
+    Uses the linearised variance of a ratio estimator, which accounts for
+    the per-trial clustering of e.g. sites within trials.
+    """
+    n = len(numerators)
+    total = sum(denominators)
+    if not n or not total:
+        return 0.0, 0.0
+    r = sum(numerators) / total
+    if n < 2:
+        return r, 0.0
+    mean_den = total / n
+    resid = sum((a - r * d) ** 2 for a, d in zip(numerators, denominators)) / (n - 1)
+    fpc = (population - n) / (population - 1) if population > 1 else 0.0
+    return r, z * math.sqrt(max(fpc, 0.0) * resid / n) / mean_den